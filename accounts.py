@@ -0,0 +1,169 @@
+from typing import List, Dict
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import httplib2
+import gspread
+from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+from utils import ensure
+import gapi
+import consts
+
+# Pool of service accounts to spread the Sheets API quota over. Each spreadsheet has to be shared
+# with every account in the pool. Calls go through the current account; it is switched for the
+# least used one when it reaches its per-minute quota, or gets throttled (HTTP 429) anyway.
+# Switching never swaps a service from under a call in flight: each call picks its service and
+# connection when it starts, from the account current at the time.
+
+scope = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/spreadsheets"
+]
+
+class Account:
+    def __init__(self, path: str):
+        creds = Credentials.from_service_account_file(path, scopes=scope)
+        self.path = path
+        self.email = creds.service_account_email
+        self.creds = creds
+        self.client = gspread.authorize(creds)
+        # for raw API calls: services are shared by all threads, but a connection can only carry one
+        # call at a time, so each call borrows one and gives it back. Connections outlive the threads
+        # that opened them, which a daemon starts anew for every run.
+        self.services: Dict[str, any] = {}
+        self.connections: List[AuthorizedHttp] = [] # idle
+        self.lock = threading.Lock()
+        self.calls: deque = deque() # times of the calls in the last minute
+        self.total_calls = 0
+        self.throttled = 0
+        self.throttled_until = 0.0
+
+    def service(self, api: str):
+        with self.lock:
+            if api not in self.services:
+                self.services[api] = build(api, {'sheets': 'v4', 'drive': 'v3'}[api], credentials=self.creds)
+            return self.services[api]
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            http = self.connections.pop() if len(self.connections) > 0 else AuthorizedHttp(self.creds, http=httplib2.Http())
+        try:
+            yield http
+        finally:
+            with self.lock:
+                self.connections.append(http)
+
+    def recent_calls(self) -> int:
+        while len(self.calls) > 0 and self.calls[0] < time.time() - 60:
+            self.calls.popleft()
+        return len(self.calls)
+
+    def usage(self) -> Dict:
+        return {
+            'account': self.email,
+            'calls_last_minute': self.recent_calls(),
+            'calls': self.total_calls,
+            'throttled': self.throttled
+        }
+
+pool: List[Account] = []
+current: Account = None
+lock = threading.Lock()
+
+def credential_files(paths: List[str]) -> List[str]:
+    """Credential files as given, with directories standing for all the .json files in them."""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith('.json')))
+        else:
+            files.append(path)
+    return files
+
+def load(paths: List[str]):
+    files = credential_files(paths)
+    ensure(len(files) > 0, f'No credentials found in {", ".join(paths)}.')
+    pool.clear()
+    pool.extend(Account(f) for f in files)
+    gapi.get_service = service
+    gapi.before_call = before_call
+    gapi.on_throttled = on_throttled
+    use(pool[0])
+    if len(pool) > 1:
+        print(f'✔ {len(pool)} service accounts loaded.')
+
+def use(account: Account):
+    """Switches the account calls go through; each call takes its thread's service of the account current at the time."""
+    global current
+    current = account
+
+@contextmanager
+def service(api: str):
+    """The current account's service for an API, and a connection to make one call over."""
+    account = current
+    with account.connection() as http:
+        yield account.service(api), http
+
+def least_used() -> Account:
+    """The available account with the fewest calls in the last minute, or None if all are throttled."""
+    available = [a for a in pool if a.throttled_until <= time.time()]
+    return None if len(available) == 0 else min(available, key=lambda a: a.recent_calls())
+
+def pick() -> Account:
+    """Assigns the next run or workload to the least used account."""
+    with lock:
+        account = least_used() or min(pool, key=lambda a: a.throttled_until)
+        use(account)
+    return account
+
+def before_call():
+    with lock:
+        if current.recent_calls() >= consts.QUOTA_CALLS_PER_MINUTE:
+            account = least_used()
+            if account is not None and account.recent_calls() < current.recent_calls():
+                print(f'→ {current.email} is at its quota, switching to {account.email}.')
+                use(account)
+        current.calls.append(time.time())
+        current.total_calls += 1
+
+def on_throttled():
+    """Called when a call was throttled; switches account, or waits for one to cool down."""
+    with lock:
+        current.throttled += 1
+        current.throttled_until = time.time() + consts.THROTTLE_COOLDOWN
+        account = least_used()
+        if account is None:
+            account = min(pool, key=lambda a: a.throttled_until)
+        wait = max(0, account.throttled_until - time.time())
+        print(f'! {current.email} throttled, {"waiting " + str(round(wait)) + "s for" if wait > 0 else "switching to"} {account.email}.')
+        use(account)
+    time.sleep(wait)
+
+def usage() -> List[Dict]:
+    with lock:
+        return [a.usage() for a in pool]
+
+def reset_usage():
+    """Starts counting calls afresh, e.g. for each workload of a worker process to report its own."""
+    with lock:
+        for a in pool:
+            a.total_calls = 0
+            a.throttled = 0
+
+def add_usage(usages: List[Dict]):
+    """Counts calls made through the same accounts elsewhere, e.g. by worker processes."""
+    with lock:
+        for u in usages:
+            for a in pool:
+                if a.email == u['account']:
+                    a.total_calls += u['calls']
+                    a.throttled += u['throttled']
@@ -1,4 +1,8 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Iterator
+from fnmatch import fnmatch
+
+import os
+import csv
 
 from sheet import Sheet, Tab
 
@@ -8,6 +12,8 @@ import consts
 
 from timer import Timer
 
+LOAD_COLUMNS = ['tab', 'variable', 'period', 'value']
+
 class Command:
     def __init__(self, args: List[str]):
         self.args = args
@@ -17,6 +23,8 @@ class Command:
                 cmd_build(sheet, self.args[1:])
             case 'spawn':
                 cmd_spawn(sheet, self.args[1:])
+            case 'matrix':
+                cmd_matrix(sheet, self.args[1:])
             case 'map':
                 cmd_map(sheet, self.args[1:])
             case 'trend':
@@ -27,9 +35,49 @@ class Command:
                 cmd_set(sheet, self.args[1:])
             case 'group':
                 cmd_group(sheet, self.args[1:])
+            case 'sensitivity':
+                cmd_sensitivity(sheet, self.args[1:])
+            case 'seek':
+                cmd_seek(sheet, self.args[1:])
+            case 'load':
+                cmd_load(sheet, self.args[1:])
             case _:
                 print(f'? Command not recognized, ignored: {self.args[0].upper()}')
 
+def run_steps(sheet: Sheet, summarize: bool = True):
+    """
+    Runs the remaining steps and the summary, checkpointing the journal at the start of each step.
+    Requests are sent in the background as they pile up, cut between steps, while the next steps are being built.
+    Scenario deltas leave the summary of the book they run in as it is.
+    """
+    sheet.checkpoint()
+    sheet.history.start()
+    gapi.start_pipeline(sheet.ref, sheet.journal.cut, sheet.journal.record_batch)
+    ok = False
+    try:
+        cmd = sheet.steps_tab.read_next_command()
+        while cmd is not None:
+            timer = Timer()
+            Command(cmd).exec(sheet)
+            sheet.history.step(sheet.steps_tab.cursor, cmd, timer.elapsed())
+            sheet.checkpoint()
+            gapi.dispatch_full_requests()
+            cmd = sheet.steps_tab.read_next_command()
+
+        if summarize:
+            timer = Timer()
+            sheet.summarize()
+            sheet.history.step(sheet.steps_tab.cursor + 1, ['summarize'], timer.elapsed())
+            sheet.publish()
+
+        sheet.flush()
+        ok = True
+    finally:
+        gapi.stop_pipeline()
+        # failed runs are kept too, but not used as a baseline
+        sheet.record_history(ok)
+    sheet.journal.complete()
+
 
 def cmd_set(sheet: Sheet, args):
     arg = args[0].lower()
@@ -37,12 +85,20 @@ def cmd_set(sheet: Sheet, args):
         val = int(period_index(args[1])) if arg == 'summary-start' else int(args[1])
         print(f'✔ Setting {arg} to {val}.')
         sheet.settings[arg] = val
+    elif arg in ['template-cache', 'summary-mode']:
+        val = args[1].lower()
+        options = {'template-cache': ['run', 'keep', 'off'], 'summary-mode': ['wide', 'long']}[arg]
+        ensure(val in options, f'{arg} must be {", ".join(options[:-1])} or {options[-1]}, not "{args[1]}".')
+        print(f'✔ Setting {arg} to {val}.')
+        sheet.settings[arg] = val
 
 def cmd_build(sheet: Sheet, args):
     t: str = args[0].strip()
     target = t.split(consts.FRIENDLY_NAME_DELIMITER)
     if target[0] not in sheet.tabs:
         raise(Exception(f'Tab "{target[0]}" not found!'))
+    if skipped(sheet, target[0]):
+        return
     friendly_name = target[0] if len(target) < 2 else target[1]
     new_tab = sheet.tabs[target[0]].duplicate(clone = True,expand_periods = True)
     new_tab.set_friendly_name(friendly_name)
@@ -50,30 +106,79 @@ def cmd_build(sheet: Sheet, args):
 
 from pprint import pprint
 def cmd_spawn(sheet: Sheet, args):
-    if args[0] not in sheet.tabs:
-        raise(Exception(f'Tab "{args[0]}" not found!'))
-    
     targets_raw = [t.strip() for t in str.split(args[1],',')]
     targets = [t.split(consts.FRIENDLY_NAME_DELIMITER) for t in targets_raw]
+    targets = [t for t in targets if not skipped(sheet, t[0])]
+    if len(targets) == 0:
+        return
+    if args[0] not in sheet.tabs:
+        raise(Exception(f'Tab "{args[0]}" not found!'))
+
     source_tab = sheet.tabs[args[0]]
-    for target in targets:
-        sheet.raw_tab_count += 1
-        gapi.duplicate_tab(source_tab.ref, f'-{target[0]}', sheet.raw_tab_count)
-    sheet.flush()
-    # now register the new ones
+    # sheet IDs are assigned up front, so registration doesn't need to wait for the duplicates to be flushed
     timer = Timer()
-    all_sheets = sheet.ref.worksheets()
-    for s in all_sheets:
-        for i, target in enumerate(targets):
-            friendly_name = target[0] if len(target) < 2 else target[1]
-            if s.title == f'-{target[0]}':
-                new_tab = source_tab.register_duplicate(s)
-                new_tab.set_friendly_name(friendly_name)
+    for target in targets:
+        friendly_name = target[0] if len(target) < 2 else target[1]
+        new_tab = sheet.spawn_tab(source_tab, f'{consts.TAB_PREFIX_DYNAMIC}{target[0]}')
+        new_tab.set_friendly_name(friendly_name)
 
     print(f'✔ New tab registrations done. {timer.check()}')
 
     return
 
+def cmd_matrix(sheet: Sheet, args):
+    # matrix [source tab] [value],[value]... [value],[value]...
+    # matrix [source tab] [value],[value]... [value],[value]... map [assumption tab],[assumption tab]...
+    # each dimension value may carry a friendly name, e.g. consumer:Consumer
+    assertMinArgs(args, 2)
+    variants, assumption_names = matrix_variants(args)
+    variants = [v for v in variants if not skipped(sheet, v[0])]
+    if len(variants) == 0:
+        return
+    source_tab = sheet.get_tab(args[0])
+    assumption_tabs = [sheet.get_tab(a) for a in assumption_names]
+
+    timer = Timer()
+    mapped = 0
+    for name, friendly_name, keys in variants:
+        new_tab = sheet.spawn_tab(source_tab, f'{consts.TAB_PREFIX_DYNAMIC}{name}')
+        new_tab.set_friendly_name(friendly_name)
+
+        # wire up assumption columns keyed by this variant's dimension values,
+        # preferring a column for the full combination (e.g. consumer-low) over a single value
+        for a in assumption_tabs:
+            col = next((c for c in ['-'.join(keys)] + keys if c in a.cols), None)
+            if col is None:
+                continue
+            var_cols = [(var, col) for var in a.vars if var in new_tab.vars]
+            mapped += map_into(sheet, a, new_tab, var_cols)[0]
+
+    print(f'✔ {len(variants)} variant tab(s) spawned from {source_tab.name}, {mapped} variable mapping(s). {timer.check()}')
+
+def matrix_variants(args) -> Tuple[List[Tuple[str, str, List[str]]], List[str]]:
+    """(name, friendly name, dimension values) of every combination, and the assumption tabs to map from."""
+    dims = args[1:]
+    assumption_names: List[str] = []
+    if 'map' in dims:
+        i = dims.index('map')
+        ensure(i + 1 < len(dims), 'No assumption tabs given after "map".')
+        assumption_names = [t.strip() for t in dims[i + 1].split(',')]
+        dims = dims[:i]
+    dims = [[v.strip().split(consts.FRIENDLY_NAME_DELIMITER) for v in d.split(',')] for d in dims]
+
+    combinations = [[]]
+    for d in dims:
+        combinations = [c + [x] for c in combinations for x in d]
+    variants = [
+        (
+            '-'.join([args[0]] + [x[0] for x in c]),
+            ' '.join([x[0] if len(x) < 2 else x[1] for x in c]),
+            [x[0] for x in c]
+        )
+        for c in combinations
+    ]
+    return variants, assumption_names
+
 def parse_var(tab: Tab, arg: str) -> Tuple[Tuple[int, int], str]:
     if consts.COL_DELIMITER in arg:
         a, b = arg.split(consts.COL_DELIMITER)
@@ -87,7 +192,14 @@ def cmd_map(sheet: Sheet, args):
     # map [source tab] [source var] [target tab] [target var]
     # map [source tab] [source var]:[source col] [target tab] [target var]:[target col]
     # map [source tab] [source var] [source col] [target tab] [target var] [target col]
+    # map [source tab] [var],[var]... [target tab],[target tab]...
+    assertMinArgs(args, 3)
+    if len(args) == 3:
+        cmd_map_bulk(sheet, args)
+        return
     assertMinArgs(args, 4)
+    if skipped(sheet, args[2] if len(args) == 4 else args[3]):
+        return
     s = sheet.get_tab(args[0])
     if len(args) == 4:
         t = sheet.get_tab(args[2])
@@ -120,20 +232,92 @@ def cmd_map(sheet: Sheet, args):
         ensure(False, f'Cannot map source var periods ({args[1]}) to a target var column ({args[3]}).')
 
     if tcol == 'p':
-        if scol == 'p':
-            # ✔ source is periods, target is periods
-            sources = s.get_var_col_refs(sv, scol)
-            mappings = [[f'=\'{s.ref.title}\'!{ref}' for ref in x] for x in sources]
-        else:
-            # ✔ source is col, target is periods
-            sources = s.get_var_col_refs(sv, scol)
-            # pick up the same source repeatedly
-            mappings = [[f'=\'{s.ref.title}\'!{ref}'] * sheet.settings['periods'] for ref in sources]
-        t.update_period_cells(tv[0], mappings)
+        t.fill_period_cells(tv[0], period_mapping_seeds(s, sv, scol, t))
         print(f'✔ Done.')
 
+def period_mapping_seeds(s: Tab, sv: Tuple[int, int], scol: str, t: Tab) -> List[str]:
+    """Formulas for each row of the source var in the first target period, to be filled across the rest by the server."""
+    if scol == 'p' and s.orientation == t.orientation:
+        # ✔ source is periods, target is periods
+        # relative reference, so each filled period picks up the matching source period
+        return [f'=\'{s.ref.title}\'!{s.cell_ref(sv[0] + y, s.get_pcol())}' for y in range(0, sv[1])]
+    elif scol == 'p':
+        # ✔ source is periods, target is periods the other way round
+        # a filled reference would move along the wrong way, so the source period is indexed by the target's position
+        axis = 'ROW' if t.orientation == 'rows' else 'COLUMN'
+        first = t.cell_ref(1, t.get_pcol(), absolute=True)
+        return [f'=INDEX({s.period_range_ref(sv[0] + y)},{axis}()-{axis}({first})+1)' for y in range(0, sv[1])]
+    else:
+        # ✔ source is col, target is periods
+        # absolute reference, to pick up the same source repeatedly
+        return [f'=\'{s.ref.title}\'!{s.cell_ref(sv[0] + y, s.get_col(scol), absolute=True)}' for y in range(0, sv[1])]
+
+def cmd_map_bulk(sheet: Sheet, args):
+    # map [source tab] [var],[var]... [target tab],[target tab]...
+    # map [source tab] [pattern]:[source col] [target tab],[target tab]...
+    # patterns may use wildcards (e.g. takeup-*), and * alone maps all variables shared by both tabs
+    timer = Timer()
+    s = sheet.get_tab(args[0])
+    targets = [sheet.get_tab(t.strip()) for t in args[2].split(',') if not skipped(sheet, t.strip())]
+    patterns = [p.strip() for p in args[1].split(',')]
+
+    var_count = 0
+    block_count = 0
+    for t in targets:
+        var_cols: List[Tuple[str, str]] = []
+        for pattern in patterns:
+            pattern, scol = pattern.split(consts.COL_DELIMITER) if consts.COL_DELIMITER in pattern else [pattern, 'p']
+            s.get_col(scol)
+            var_cols.extend([(var, scol) for var in match_vars(s, t, pattern)])
+        vars_mapped, blocks = map_into(sheet, s, t, var_cols)
+        var_count += vars_mapped
+        block_count += blocks
+
+    print(f'✔ {var_count} variable mapping(s) into {len(targets)} tab(s), in {block_count} block write(s). {timer.check()}')
+
+def map_into(sheet: Sheet, s: Tab, t: Tab, var_cols: List[Tuple[str, str]]) -> Tuple[int, int]:
+    """
+    Maps each (var, source col) onto the var of the same name across the target's periods,
+    with one write per run of adjacent target rows. Returns the vars mapped and the writes queued.
+    """
+    ensure(t.get_pcol() is not None, f'Target tab "{t.name}" does not have a period column.')
+    var_count = 0
+    rows: Dict[int, str] = {} # target row -> seed formula for the first period
+    for var, scol in var_cols:
+        sv = s.get_var_rows(var)
+        tv = t.get_var_rows(var)
+        if sv[1] != tv[1]:
+            print(f'! Mismatch in multi-row variable heights for {var} in {s.name} and {t.name}, skipped.')
+            continue
+        for y, seed in enumerate(period_mapping_seeds(s, sv, scol, t)):
+            rows[tv[0] + y] = seed
+        var_count += 1
+    blocks = contiguous_runs(sorted(rows))
+    for block in blocks:
+        t.fill_period_cells(block[0], [rows[r] for r in block])
+    return var_count, len(blocks)
+
+def match_vars(s: Tab, t: Tab, pattern: str) -> List[str]:
+    """Variables in both tabs matching the pattern; plain names must exist in both."""
+    if any(c in pattern for c in '*?['):
+        return [var for var in s.vars if fnmatch(var, pattern) and var in t.vars]
+    s.get_var_rows(pattern)
+    t.get_var_rows(pattern)
+    return [pattern]
+
+def contiguous_runs(rows: List[int]) -> List[List[int]]:
+    runs: List[List[int]] = []
+    for r in rows:
+        if len(runs) > 0 and runs[-1][-1] == r - 1:
+            runs[-1].append(r)
+        else:
+            runs.append([r])
+    return runs
+
 def cmd_trend(sheet: Sheet, args):
     assertMinArgs(args, 5)
+    if skipped(sheet, args[0]):
+        return
     t = sheet.get_tab(args[0])
     tv, rows = t.get_var_rows(args[1])
     ensure(rows == 1, f'{args[1]} is a multi-row variable, trend cannot be performed on it.')
@@ -154,7 +338,7 @@ def cmd_trend(sheet: Sheet, args):
     for i in range(len(cells)):
         cells[i] = v
         v = v * incMul + incAdd
-    gapi.update_cells(t.ref, tv, startP, [cells])
+    t.update_block(tv, startP, [cells])
     print(f'✔ Done.')
     return
 
@@ -171,6 +355,8 @@ def get_col_range(v: str, t: Tab, range_required: bool = False) -> Tuple[int, in
 
 def cmd_bump(sheet: Sheet, args):
     assertMinArgs(args, 4)
+    if skipped(sheet, args[0]):
+        return
     t = sheet.get_tab(args[0])
     tv, rows = t.get_var_rows(args[1])
     ensure(rows == 1, f'{args[1]} is a multi-row variable, bump cannot be performed on it.')
@@ -179,10 +365,7 @@ def cmd_bump(sheet: Sheet, args):
     count = endP - startP + 1
 
     v = float(args[3])
-    cells: List[str] = [''] * count
-    for i in range(len(cells)):
-        cells[i] = v
-    gapi.update_cells(t.ref, tv, startP, [cells])
+    t.repeat_value(tv, startP, 1, count, v)
 
     print(f'✔ Done.')
     return
@@ -190,10 +373,297 @@ def cmd_bump(sheet: Sheet, args):
 def cmd_group(sheet: Sheet, args):
     assertMinArgs(args, 2)
     label = args[0]
-    tabs = [t.strip() for t in args[1].split(',')]
+    tabs = [t.strip() for t in args[1].split(',') if not skipped(sheet, t.strip())]
     sheet.add_tab_group(label, tabs)
 
+def cmd_sensitivity(sheet: Sheet, args):
+    # sensitivity [tab] [output var],[output var]... [input var],[input var]... [change]
+    # sensitivity [tab] [output var]:[period]-[period] [input var]:[col],[input var]... [change] [change]...
+    # sensitivity [tab] summary [input var],[input var]... [change]
+    # a single change is tried both ways (10% is -10% and +10%); outputs and inputs may use wildcards
+    assertMinArgs(args, 4)
+    if skipped(sheet, args[0]):
+        return
+    timer = Timer()
+    base = sheet.get_tab(args[0])
+    ensure(base.get_pcol() is not None, f'Tab "{base.name}" does not have a period column.')
+    outputs = [(label, parse_target(base, label)) for label in output_targets(sheet, base, args[1])]
+    inputs = [(label, parse_target(base, label)) for label in match_targets(base, args[2])]
+    changes = [parse_change(c) for c in args[3:]]
+    if len(changes) == 1:
+        changes = [-abs(changes[0]), abs(changes[0])]
+
+    # a probe copy of the tab for every input and change, all created in one batch, with the input
+    # scaled from the tab's own values
+    probes: List[Tab] = []
+    for label, (var, start, end) in inputs:
+        for change in changes:
+            probe = sheet.probe_tab(base, f'{base.name} {label} {format_change(change)}')
+            probe.update_block(var[0], start, [
+                [f'=\'{base.ref.title}\'!{base.cell_ref(var[0] + y, c)}*{1 + change}' for c in range(start, end + 1)]
+                for y in range(var[1])
+            ])
+            probes.append(probe)
+    sheet.flush()
+    # every output of every tab, in one call
+    totals = read_totals(sheet, [t.range_ref(*target) for t in [base] + probes for _, target in outputs])
+    sheet.drop_tabs(probes)
+
+    # a table per output, each ranked by swing
+    block: List[List[any]] = []
+    for o, (output_label, _) in enumerate(outputs):
+        tab_totals = totals[o::len(outputs)]
+        results: List[Tuple[str, List[float], float]] = []
+        for i, (label, _) in enumerate(inputs):
+            values = tab_totals[1 + i * len(changes):1 + (i + 1) * len(changes)]
+            results.append((label, values, max(values) - min(values)))
+        results.sort(key=lambda r: -r[2])
+        if len(block) > 0:
+            block.append([''] * (len(changes) + 2))
+        block.append([output_label] + [format_change(c) for c in changes] + ['Swing'])
+        block.append(['Base'] + [tab_totals[0]] * len(changes) + [0])
+        block.extend([label] + values + [swing] for label, values, swing in results)
+    # the step's position keeps the tab apart from those of other sensitivity steps on the same tab
+    sheet.add_values_tab(f'{consts.TAB_PREFIX_DYNAMIC}sensitivity {sheet.steps_tab.cursor} {base.name}', block)
+
+    print(f'✔ Sensitivity of {len(outputs)} output(s) in {base.name} to {len(inputs)} input(s), {len(probes)} probe(s). {timer.check()}')
+    for row in block:
+        if row[0] == '':
+            print()
+        elif isinstance(row[1], str):
+            print(f'  {row[0][:23]:<24}' + ''.join(f'{h:>14}' for h in row[1:]))
+        else:
+            print(f'  {row[0][:23]:<24}' + ''.join(f'{v:>14,.2f}' for v in row[1:]))
+
+def cmd_seek(sheet: Sheet, args):
+    # seek [tab] [output var]:[period] [target value] [input var] [low] [high]
+    # seek [tab] [output var]:[period] [target value] [input var]:[col] [low] [high] [probes]
+    # finds the input value, between low and high, that brings the output to the target, and sets it
+    assertMinArgs(args, 6)
+    if skipped(sheet, args[0]):
+        return
+    timer = Timer()
+    base = sheet.get_tab(args[0])
+    ensure(base.get_pcol() is not None, f'Tab "{base.name}" does not have a period column.')
+    output = parse_target(base, args[1])
+    target = float(args[2])
+    var, start, end = parse_target(base, args[3])
+    low, high = float(args[4]), float(args[5])
+    ensure(low < high, f'The low end of the search ({args[4]}) must be below the high end ({args[5]}).')
+    count = int(args[6]) if len(args) > 6 else consts.SEEK_PROBES
+    ensure(count >= 2, 'At least 2 probes are needed.')
+    tolerance = consts.SEEK_TOLERANCE * max(1, abs(target))
+
+    probes = [sheet.probe_tab(base, f'{base.name} seek {i + 1}') for i in range(count)]
+    def try_values(values: List[float]) -> List[float]:
+        """One round trip: every probe gets a value in the same batch, and their outputs are read in one call."""
+        for probe, value in zip(probes, values):
+            probe.repeat_value(var[0], start, var[1], end - start + 1, value)
+        sheet.flush()
+        return read_totals(sheet, [probe.range_ref(*output) for probe in probes[:len(values)]])
+
+    # the bracket narrows to the pair of neighbouring probes the output crosses the target between
+    values = [low + (high - low) * i / (count - 1) for i in range(count)]
+    points = list(zip(values, try_values(values)))
+    rounds = 1
+    while True:
+        best = min(points, key=lambda p: abs(p[1] - target))
+        bracket = next(((a, b) for a, b in zip(points, points[1:]) if (a[1] - target) * (b[1] - target) <= 0), None)
+        if bracket is None or abs(best[1] - target) <= tolerance or rounds >= consts.SEEK_ROUNDS:
+            break
+        (a, fa), (b, fb) = bracket
+        values = [a + (b - a) * (i + 1) / (count + 1) for i in range(count)]
+        points = [(a, fa)] + list(zip(values, try_values(values))) + [(b, fb)]
+        rounds += 1
+    sheet.drop_tabs(probes)
+
+    outputs = [p[1] for p in points]
+    ensure(bracket is not None or abs(best[1] - target) <= tolerance, f'{args[1]} stays between {min(outputs):,.4g} and {max(outputs):,.4g} for {args[3]} from {args[4]} to {args[5]}, and never reaches {target:,.4g}.')
+    value = best[0]
+    if bracket is not None and abs(best[1] - target) > tolerance and bracket[0][1] != bracket[1][1]:
+        # closer still between the last two probes, assuming the output is close to linear there
+        (a, fa), (b, fb) = bracket
+        value = a + (b - a) * (target - fa) / (fb - fa)
+    base.repeat_value(var[0], start, var[1], end - start + 1, value)
+    print(f'✔ {args[3]} set to {value:,.6g}, for {args[1]} of {best[1]:,.6g} (target {target:,.6g}), in {rounds} round(s) of {count} probe(s). {timer.check()}')
+
+def cmd_load(sheet: Sheet, args):
+    # load [path to .csv or .parquet]
+    # rows of tab, variable, period, value, and optionally item (the row within a multi-row variable),
+    # as written by export; periods may be given as p3 or 3, or be another column label such as p0
+    assertMinArgs(args, 1)
+    timer = Timer()
+    cells: Dict[str, Dict[Tuple[int, int], any]] = {} # tab -> (row, col) -> value
+    problems: Dict[str, int] = {}
+    skips: Dict[str, bool] = {} # tab -> skipped, so each skipped tab is only reported once
+    count = 0
+    for tab_name, var, item, period, value in read_load_rows(args[0]):
+        count += 1
+        if tab_name not in skips:
+            skips[tab_name] = skipped(sheet, tab_name)
+        if skips[tab_name] or value is None or value == '':
+            continue
+        item = load_item(item)
+        problem = None
+        if tab_name not in sheet.tabs:
+            problem = f'tab "{tab_name}" not found'
+        elif sheet.tabs[tab_name].type == 'summary':
+            # e.g. the summary rows of an export, which the run rebuilds
+            problem = 'the summary is built by the run'
+        elif var not in sheet.tabs[tab_name].vars:
+            problem = f'variable "{var}" not found in tab "{tab_name}"'
+        elif item is None:
+            problem = 'the item is not a row number'
+        if problem is not None:
+            problems[problem] = problems.get(problem, 0) + 1
+            continue
+        t = sheet.tabs[tab_name]
+        ensure(not (t.type == 'input' and t.get_pcol() is not None and not t.prebaked_periods), f'Tab "{tab_name}" has not had its periods expanded; load into a tab generated from it, or give it pre-baked period columns.')
+        row, height = t.get_var_rows(var)
+        ensure(1 <= item <= height, f'Item {item} is out of range for variable "{var}" in tab "{tab_name}", which has {height} row(s).')
+        label = period_label(period)
+        p = period_index(label.lower()) if is_period(label.lower()) else 0
+        if p >= 1:
+            ensure(t.get_pcol() is not None, f'Tab "{tab_name}" does not have a period column to load {label} into.')
+            ensure(p <= sheet.settings['periods'], f'Period {label} is out of range for tab "{tab_name}", which has {sheet.settings["periods"]} period(s).')
+            col = t.get_pcol() - 1 + p
+        else:
+            # p0 is a column of its own, like any other label, not the one before the periods
+            col = t.get_col(label)
+        cells.setdefault(tab_name, {})[(row + item - 1, col)] = value
+
+    writes = 0
+    for tab_name, tab_cells in cells.items():
+        t = sheet.tabs[tab_name]
+        blocks = value_blocks(tab_cells)
+        for row, col, values in blocks:
+            t.update_block(row, col, values)
+        writes += len(blocks)
+
+    for problem, n in problems.items():
+        print(f'! {n} row(s) skipped, {problem}.')
+    print(f'✔ {count} row(s) read, {sum(len(c) for c in cells.values())} value(s) into {len(cells)} tab(s), in {writes} block write(s). {timer.check()}')
+
+def load_item(item) -> int:
+    """The row within a variable, 1 if not given, or None if it isn't a row number (e.g. a summary line's tab)."""
+    if item is None or item == '':
+        return 1
+    try:
+        number = float(item)
+    except (ValueError, TypeError):
+        return None
+    return int(number) if number.is_integer() else None
+
+def period_label(period) -> str:
+    """A period given as a number (3, or 3.0 from Parquet) as its label, p3; any column label as it is."""
+    try:
+        number = float(period)
+    except (ValueError, TypeError):
+        return str(period)
+    return f'p{int(number)}' if number.is_integer() else str(period)
+
+def value_blocks(cells: Dict[Tuple[int, int], any]) -> List[Tuple[int, int, List[List[any]]]]:
+    """
+    Cells as rectangles to write, each as its first row, first column and rows of values: runs of
+    adjacent columns in a row, stacked while the next row has the same run.
+    """
+    row_cols: Dict[int, List[int]] = {}
+    for row, col in sorted(cells):
+        row_cols.setdefault(row, []).append(col)
+    blocks: List[List] = [] # first row, columns, rows
+    open_blocks: Dict[Tuple[int, Tuple[int, ...]], List] = {} # next row and columns -> block they extend
+    for row, cols in row_cols.items():
+        for run in contiguous_runs(cols):
+            block = open_blocks.pop((row, tuple(run)), None)
+            if block is None:
+                block = [row, run, 0]
+                blocks.append(block)
+            block[2] += 1
+            open_blocks[(row + 1, tuple(run))] = block
+    return [
+        (first, cols[0], [[cells[(first + y, c)] for c in cols] for y in range(height)])
+        for first, cols, height in blocks
+    ]
+
+def read_load_rows(path: str) -> Iterator[Tuple[str, str, any, any, any]]:
+    """Streams (tab, variable, item, period, value) from a .csv or .parquet file, with numbers as numbers."""
+    ensure(os.path.exists(path), f'File "{path}" not found.')
+    if path.lower().endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            ensure(False, 'Loading Parquet needs pyarrow (pip install pyarrow). Load a .csv instead?')
+        f = pq.ParquetFile(path)
+        columns = f.schema_arrow.names
+        ensure(all(c in columns for c in LOAD_COLUMNS), f'{path} needs the columns {", ".join(LOAD_COLUMNS)}.')
+        for batch in f.iter_batches(columns=LOAD_COLUMNS + (['item'] if 'item' in columns else [])):
+            data = batch.to_pydict()
+            items = data.get('item', [None] * batch.num_rows)
+            yield from zip(data['tab'], data['variable'], items, data['period'], data['value'])
+        return
+
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        ensure(reader.fieldnames is not None and all(c in reader.fieldnames for c in LOAD_COLUMNS), f'{path} needs the columns {", ".join(LOAD_COLUMNS)}.')
+        for row in reader:
+            value = row['value']
+            try:
+                value = float(value)
+            except ValueError:
+                pass # text or a formula
+            yield row['tab'], row['variable'], row.get('item'), row['period'], value
+
 # Utilities
 
+def skipped(sheet: Sheet, tab_name: str) -> bool:
+    """Tabs left out of this run (e.g. pruned as unable to reach the summary) are not generated or written to."""
+    if tab_name in sheet.skip_tabs:
+        print(f'  Skipping tab "{tab_name}".')
+        return True
+    return False
+
+def parse_target(t: Tab, arg: str) -> Tuple[Tuple[int, int], int, int]:
+    """
+    A variable's rows and the label columns they span: all its periods, or those given after it,
+    as a column, period or period range (e.g. fees:p0, fees:p12, fees:p1-p12).
+    """
+    var, _, cols = arg.partition(consts.COL_DELIMITER)
+    rows = t.get_var_rows(var)
+    if cols == '':
+        return rows, t.get_pcol(), t.get_pcol() + t.sheet.settings['periods'] - 1
+    start, end = get_col_range(cols, t)
+    return rows, start, end
+
+def match_targets(t: Tab, arg: str) -> List[str]:
+    """Comma-separated variables, with wildcards expanded, each keeping the columns given after it."""
+    targets: List[str] = []
+    for pattern in arg.split(','):
+        var, delimiter, cols = pattern.strip().partition(consts.COL_DELIMITER)
+        # overlapping patterns (e.g. `fees,fee*`) would otherwise give the same target twice
+        targets.extend(target for target in (f'{v}{delimiter}{cols}' for v in match_vars(t, t, var)) if target not in targets)
+    return targets
+
+def output_targets(sheet: Sheet, t: Tab, arg: str) -> List[str]:
+    """Outputs to measure: variables as for match_targets, or `summary` for each summary variable the tab has."""
+    if arg.lower() != 'summary':
+        return match_targets(t, arg)
+    targets = [var for var, _ in sheet.summary_vars if var in t.vars]
+    ensure(len(targets) > 0, f'Tab "{t.name}" has none of the summary variables.')
+    return targets
+
+def parse_change(arg: str) -> float:
+    """10% or 0.1"""
+    return float(arg.rstrip('%')) / 100 if arg.endswith('%') else float(arg)
+
+def format_change(change: float) -> str:
+    return f'{change * 100:+g}%'
+
+def read_totals(sheet: Sheet, ranges: List[str]) -> List[float]:
+    """Sum of the numbers in each range, all read in one call, in the order given."""
+    return [
+        sum(v for row in rows for v in row if isinstance(v, (int, float)))
+        for rows in gapi.read_value_ranges(sheet.ref, ranges, 'UNFORMATTED_VALUE')
+    ]
+
 def assertMinArgs(args, min):
     ensure(len(args) >= min, f'Not enough arguments, we need at least {min}.')
@@ -0,0 +1,106 @@
+from typing import List, Dict
+
+import re
+import asyncio
+from functools import partial
+
+from sheet import open_spreadsheet, unused_sheet_id, local_worksheet
+from utils import parallel_calls, ensure
+from timer import Timer
+import gapi
+import consts
+
+def read_summary(spreadsheet_id: str) -> Dict:
+    """Values of a book's generated summary, keyed by variable, then by period and period group labels."""
+    spreadsheet = open_spreadsheet(spreadsheet_id)
+    rows = list(gapi.read_ranges(spreadsheet, [f'\'{consts.TAB_PREFIX_DYNAMIC}{consts.TAB_TITLE_SUMMARY[1:]}\''], 'UNFORMATTED_VALUE').values())[0]
+    header = rows[0] if len(rows) > 0 else []
+    # columns labelled P1, P2... are periods, and P1-P12... are period groups
+    columns = {col: str(label) for col, label in enumerate(header) if re.match(r'^P\d+(-P\d+)?$', str(label))}
+    ensure(len(columns) > 0, f'The summary of "{spreadsheet.title}" has no period columns; only wide summaries can be consolidated.')
+
+    vars: Dict[str, Dict] = {}
+    var = None
+    for cells in rows[1:]:
+        label = str(cells[0]) if len(cells) > 0 else ''
+        line = str(cells[1]) if len(cells) > 1 else ''
+        values = {columns[col]: cells[col] for col in columns if col < len(cells)}
+        if label != '':
+            # total row of a summarized variable, followed by a row per tab
+            var = label.split(consts.VAR_SUMMARY_METHOD_DELIMITER)[0]
+            vars[var] = {'total': values, 'lines': []}
+        elif var is not None and line.strip() != '':
+            vars[var]['lines'].append((line, values))
+    return {
+        'title': spreadsheet.title,
+        'columns': list(columns.values()),
+        'vars': vars
+    }
+
+def add_values(total: Dict[str, float], values: Dict[str, any]):
+    for label, v in values.items():
+        if isinstance(v, (int, float)):
+            total[label] = total.get(label, 0) + v
+
+def consolidate(target_id: str, source_ids: List[str]):
+    """
+    Reads the summaries of several books in parallel, aligns them by variable and period,
+    and writes them as plain values into one tab of the target book, subtotalled per book.
+    """
+    timer = Timer()
+    print(f'→ Reading the summaries of {len(source_ids)} book(s)...')
+    books = asyncio.run(parallel_calls(*[partial(read_summary, i) for i in source_ids]))
+
+    # align periods and variables in order of first appearance, periods before period groups
+    columns: List[str] = []
+    vars: List[str] = []
+    for book in books:
+        columns.extend([c for c in book['columns'] if c not in columns])
+        vars.extend([v for v in book['vars'] if v not in vars])
+    columns = [c for c in columns if '-' not in c] + [c for c in columns if '-' in c]
+
+    def row(label_a: str, label_b: str, values: Dict[str, any]) -> List[any]:
+        return [label_a, label_b] + [values[c] if c in values else '' for c in columns]
+
+    block: List[List[any]] = [row('', '', {c: c for c in columns})]
+    row_groups: List[List[int]] = [] # start, end rows (0-based, end exclusive) to collapse
+    for var in vars:
+        total: Dict[str, float] = {}
+        for book in books:
+            if var in book['vars']:
+                add_values(total, book['vars'][var]['total'])
+        block.append(row(var, 'Total', total))
+        var_start = len(block)
+        for book in books:
+            if var not in book['vars']:
+                continue
+            block.append(row('', book['title'], book['vars'][var]['total']))
+            book_start = len(block)
+            for line, values in book['vars'][var]['lines']:
+                block.append(row('', consts.GROUP_INDENT + line, values))
+            if len(block) > book_start:
+                row_groups.append([book_start, len(block)])
+        if len(block) > var_start:
+            row_groups.append([var_start, len(block)])
+
+    # replace the consolidated tab, all in one batch
+    spreadsheet = open_spreadsheet(target_id)
+    # not a dynamic tab, which the target's next run would sweep away
+    title = f'{consts.TAB_PREFIX_OUTPUT}{consts.TAB_TITLE_CONSOLIDATED}'
+    worksheets = spreadsheet.worksheets()
+    for s in worksheets:
+        if s.title == title:
+            gapi.delete_tab(s)
+    sheet_id = unused_sheet_id(set(s.id for s in worksheets))
+    gapi.add_tab(sheet_id, title, len(block), len(block[0]))
+    tab = local_worksheet(spreadsheet, {
+        'sheetId': sheet_id,
+        'title': title,
+        'gridProperties': {'rowCount': len(block), 'columnCount': len(block[0])}
+    })
+    gapi.update_cells(tab, 1, 1, block)
+    for g in row_groups:
+        gapi.group_rows(tab, g[0], g[1])
+    gapi.flush_requests(spreadsheet)
+
+    print(f'✔ {len(vars)} variable(s) from {len(books)} book(s) consolidated into "{title}". {timer.check()}')
@@ -1,11 +1,45 @@
 VAR_HEIGHT_DELIMITER = '|'
 TAB_PREFIX_DYNAMIC = '-'
 TAB_PREFIX_INPUT = '_'
+TAB_PREFIX_EXPANDED = '~'
+TAB_PREFIX_OUTPUT = '+' # written by other commands (consolidate), and left alone by runs
+EXPANDED_FINGERPRINT_DELIMITER = '#'
 COL_DELIMITER = ':'
 FRIENDLY_NAME_DELIMITER = ':'
 VAR_SUMMARY_METHOD_DELIMITER = ':'
 
 TAB_TITLE_STEPS = '_steps'
 TAB_TITLE_SUMMARY = '_summary'
+TAB_TITLE_CONSOLIDATED = 'consolidated'
 
-GROUP_INDENT = '    '
\ No newline at end of file
+GROUP_INDENT = '    '
+JOURNAL_DIR = 'journals'
+SHARD_MAX_CELLS = 5000000 # Google Sheets allows 10M cells per spreadsheet, but slows down well before
+
+# developer metadata published on generated tabs, for other tools to find things by
+METADATA_LAYOUT = 'cfc-layout' # on each tab: name, title, type, orientation, variable rows and period columns
+METADATA_MAX_CHARS = 30000 # keys and values, per tab and per spreadsheet, allowed by the Sheets API
+
+# goal seek: probe tabs tried at once each round, and rounds before settling for the closest
+SEEK_PROBES = 8
+SEEK_ROUNDS = 8
+SEEK_TOLERANCE = 1e-6 # relative to the target
+
+# queued requests are sent in the background once either is reached, at the end of a step
+AUTO_FLUSH_REQUESTS = 1000
+AUTO_FLUSH_CELLS = 100000
+
+# per service account; the Sheets API allows 60 requests per minute per user, reads and writes each
+QUOTA_CALLS_PER_MINUTE = 60
+THROTTLE_COOLDOWN = 60 # seconds an account is left alone after being throttled
+THROTTLE_RETRIES = 5
+
+# seconds a spreadsheet's tabs fetched ahead of a run (by the daemon) are trusted for
+PREFETCH_MAX_AGE = 60
+
+# run history, kept in JOURNAL_DIR
+HISTORY_FILE = 'history.sqlite'
+HISTORY_BASELINE_RUNS = 10 # earlier successful runs a run or step is compared against
+HISTORY_MIN_BASELINE = 3 # runs needed before anything is flagged
+HISTORY_SLOWDOWN = 1.5 # flagged when slower than the baseline median by this factor...
+HISTORY_MIN_SLOWDOWN = 1.0 # ...and by at least this many seconds
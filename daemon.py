@@ -0,0 +1,160 @@
+from typing import Dict, List
+
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from sheet import initialize_sheets, open_spreadsheet, prefetch_worksheets, clean_steps, Sheet
+from commands import run_steps
+from export import export_results, layouts_from_sheet
+from journal import Journal, steps_hash
+from plan import prune
+from timer import Timer
+import accounts
+import gapi
+import consts
+
+# Long-lived local process that keeps the credentials, API services, their connections and opened
+# spreadsheets warm between runs, and the tabs of watched spreadsheets fetched ahead of their runs. Runs are submitted over a local HTTP endpoint, e.g.:
+#   python daemon.py serve --credentials ./credentials.json
+#   python daemon.py run [spreadsheet id]
+#   python daemon.py watch [spreadsheet id]
+
+DEFAULT_PORT = 8765
+
+# gapi queues requests globally, so only one job can run at a time; the watcher only checks while
+# holding it too, as tabs fetched while a run is still changing them would be stale for the next
+job_lock = threading.Lock()
+watched: List[str] = []
+
+def run_job(spreadsheet_id: str, resume: bool = False, export: str = None, skip_dead: bool = False) -> Dict:
+    with job_lock:
+        timer = Timer()
+        try:
+            account = accounts.pick()
+            print(f'\n⇨ Running {spreadsheet_id} as {account.email}...')
+            sheet = Sheet(spreadsheet_id, resume=resume)
+            prune(sheet, skip_dead)
+            run_steps(sheet)
+            if export is not None:
+                export_results(sheet.ref, layouts_from_sheet(sheet), export)
+        except (Exception, SystemExit) as e:
+            # ensure() exits on failure; the daemon has to outlive a bad run
+            gapi.discard_requests()
+            traceback.print_exc()
+            return {'ok': False, 'spreadsheet': spreadsheet_id, 'error': str(e) or type(e).__name__}
+        print(f'\n✔ Done {timer.check()}')
+        return {'ok': True, 'spreadsheet': spreadsheet_id, 'time': timer.check()}
+
+def last_run_steps_hash(spreadsheet_id: str) -> str:
+    start = next((e for e in Journal(spreadsheet_id).read() if e['event'] == 'start'), None)
+    return None if start is None else start['steps_hash']
+
+def watch_loop(interval: float):
+    """
+    Re-runs a watched spreadsheet whenever its steps differ from those of its last run. Its tabs
+    are fetched along with the steps, so the run starts with them at hand.
+    """
+    while True:
+        time.sleep(interval)
+        for spreadsheet_id in list(watched):
+            with job_lock:
+                try:
+                    rows = list(gapi.read_ranges(open_spreadsheet(spreadsheet_id), [consts.TAB_TITLE_STEPS]).values())[0]
+                    prefetch_worksheets(spreadsheet_id)
+                except Exception as e:
+                    print(f'! Could not check steps of {spreadsheet_id}: {e}')
+                    continue
+            if steps_hash(clean_steps(rows)) != last_run_steps_hash(spreadsheet_id):
+                print(f'\n⇨ Steps of {spreadsheet_id} changed, re-running...')
+                run_job(spreadsheet_id)
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/status':
+            self.reply({'ok': True, 'busy': job_lock.locked(), 'watched': watched, 'accounts': accounts.usage()})
+        else:
+            self.reply({'ok': False, 'error': f'Unknown path {self.path}'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        match self.path:
+            case '/run':
+                self.reply(run_job(body['spreadsheet'], body.get('resume', False), body.get('export'), body.get('prune', False)))
+            case '/watch':
+                if body['spreadsheet'] not in watched:
+                    watched.append(body['spreadsheet'])
+                self.reply({'ok': True, 'watched': watched})
+            case '/unwatch':
+                if body['spreadsheet'] in watched:
+                    watched.remove(body['spreadsheet'])
+                self.reply({'ok': True, 'watched': watched})
+            case _:
+                self.reply({'ok': False, 'error': f'Unknown path {self.path}'}, 404)
+
+    def reply(self, body: Dict, status: int = 200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # runs print their own progress
+
+def serve(credentials: List[str], port: int, interval: float):
+    timer = Timer()
+    initialize_sheets(credentials)
+    print(f'✔ Credentials and service loaded. {timer.check()}')
+    threading.Thread(target=watch_loop, args=(interval,), daemon=True).start()
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f'✔ Listening on 127.0.0.1:{port}, checking watched steps every {interval:g}s.')
+    server.serve_forever()
+
+def call(port: int, path: str, body: Dict = None) -> Dict:
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}{path}',
+        data=None if body is None else json.dumps(body).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cascading Forecasts daemon')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='start the daemon')
+    serve_parser.add_argument('--credentials', nargs='+', default=['./credentials.json'], help='service account credentials file(s), or directories of them')
+    serve_parser.add_argument('--interval', type=float, default=30, help='seconds between checks of watched steps tabs')
+
+    run_parser = commands.add_parser('run', help='run a spreadsheet on the daemon')
+    run_parser.add_argument('spreadsheet')
+    run_parser.add_argument('--resume', action='store_true')
+    run_parser.add_argument('--prune', action='store_true')
+    run_parser.add_argument('--export', metavar='PATH')
+
+    for name in ['watch', 'unwatch']:
+        commands.add_parser(name, help=f'{name} a spreadsheet\'s steps for changes').add_argument('spreadsheet')
+    commands.add_parser('status', help='show whether the daemon is busy, and what it watches')
+
+    args = parser.parse_args()
+    match args.command:
+        case 'serve':
+            serve(args.credentials, args.port, args.interval)
+        case 'run':
+            result = call(args.port, '/run', {'spreadsheet': args.spreadsheet, 'resume': args.resume, 'prune': args.prune, 'export': args.export})
+        case 'watch' | 'unwatch':
+            result = call(args.port, f'/{args.command}', {'spreadsheet': args.spreadsheet})
+        case 'status':
+            result = call(args.port, '/status')
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['ok'] else 1)
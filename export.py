@@ -0,0 +1,171 @@
+from typing import List, Dict, Iterator
+
+import re
+import csv
+import json
+from itertools import islice
+
+import gspread
+
+from sheet import Sheet
+from utils import col_num_to_letter, ensure
+from timer import Timer
+import gapi
+import consts
+
+EXPORT_COLUMNS = ['tab', 'variable', 'item', 'period', 'value']
+
+def layouts_from_sheet(sheet: Sheet) -> List[Dict]:
+    """Where the results are, straight from the tabs registered during a run."""
+    return [t.layout() for t in sheet.result_tabs()]
+
+def layouts_from_book(spreadsheet: gspread.spreadsheet.Spreadsheet) -> List[Dict]:
+    """Where the results of a finished run are, from its metadata, or from its headers for books run before it was published."""
+    layouts = layouts_from_metadata(spreadsheet)
+    if len(layouts) == 0:
+        print('  No metadata found, reading the headers instead.')
+        layouts = layouts_from_headers(spreadsheet)
+    return layouts
+
+def layouts_from_metadata(spreadsheet: gspread.spreadsheet.Spreadsheet) -> List[Dict]:
+    """Where the results are, from the layouts published on the generated tabs, in one call."""
+    return [json.loads(m['metadataValue']) for m in gapi.search_metadata(spreadsheet, [consts.METADATA_LAYOUT])]
+
+def layouts_from_headers(spreadsheet: gspread.spreadsheet.Spreadsheet) -> List[Dict]:
+    """Where the results are, rediscovered from the headers of the generated tabs of a finished run."""
+    tabs = [s for s in spreadsheet.worksheets() if s.title[0] == consts.TAB_PREFIX_DYNAMIC]
+    ranges: List[str] = []
+    for s in tabs:
+        ranges.append(f'\'{s.title}\'!A1:1')
+        ranges.append(f'\'{s.title}\'!A1:A')
+    values = list(gapi.read_ranges(spreadsheet, ranges).values())
+
+    layouts: List[Dict] = []
+    for i, s in enumerate(tabs):
+        row_vals = values[i * 2][0] if len(values[i * 2]) > 0 else []
+        col_vals = [el[0] if el != [] else '' for el in values[i * 2 + 1]]
+        # expanded period columns are labelled P1, P2... (or period rows, down the first column)
+        orientation = 'columns'
+        periods = [col + 1 for col, label in enumerate(row_vals) if re.match(r'^P\d+$', str(label))]
+        if len(periods) == 0:
+            orientation = 'rows'
+            periods = [row + 1 for row, label in enumerate(col_vals) if re.match(r'^P\d+$', str(label))]
+            row_vals, col_vals = col_vals, row_vals
+        if len(periods) == 0:
+            continue
+        vars: Dict[str, List[int]] = {}
+        for row, value in enumerate(col_vals):
+            if value == '':
+                continue
+            if consts.VAR_HEIGHT_DELIMITER in value:
+                var, rows = value.split(consts.VAR_HEIGHT_DELIMITER)
+                vars[var] = [row + 1, int(rows)]
+            else:
+                vars[value] = [row + 1, 1]
+        layouts.append({
+            'name': s.title[1:],
+            'title': s.title,
+            'type': 'summary' if s.title[1:] == consts.TAB_TITLE_SUMMARY[1:] else 'dynamic',
+            'orientation': orientation,
+            'vars': vars,
+            'pcol': periods[0],
+            'periods': len(periods)
+        })
+    return layouts
+
+def result_rows(spreadsheet: gspread.spreadsheet.Spreadsheet, layouts: List[Dict], page_size: int = 20) -> Iterator[List[any]]:
+    """Yields (tab, variable, item, period, value) rows, reading page_size tabs per call."""
+    for start in range(0, len(layouts), page_size):
+        page = layouts[start:start + page_size]
+        ranges: List[str] = []
+        for layout in page:
+            end_col = col_num_to_letter(layout['pcol'] + layout['periods'] - 1)
+            if layout['type'] == 'summary':
+                # the summary needs the labels in the first columns, for the rows added per tab
+                ranges.append(f'\'{layout["title"]}\'!A1:{end_col}')
+            elif layout['orientation'] == 'rows':
+                ranges.append(f'\'{layout["title"]}\'!{layout["pcol"]}:{layout["pcol"] + layout["periods"] - 1}')
+            else:
+                ranges.append(f'\'{layout["title"]}\'!{col_num_to_letter(layout["pcol"])}1:{end_col}')
+        values = gapi.read_ranges(spreadsheet, ranges, 'UNFORMATTED_VALUE').values()
+
+        for layout, rows in zip(page, values):
+            if layout['type'] == 'summary':
+                yield from summary_rows(layout, rows)
+                continue
+            if layout['orientation'] == 'rows':
+                # a row per period, variables across
+                rows = [list(x) for x in zip(*[r + [''] * (max(map(len, rows)) - len(r)) for r in rows])] if len(rows) > 0 else []
+            for var, (row, count) in layout['vars'].items():
+                for y in range(0, count):
+                    cells = rows[row - 1 + y] if row - 1 + y < len(rows) else []
+                    for p in range(0, layout['periods']):
+                        yield [layout['name'], var, y + 1 if count > 1 else '', p + 1, cells[p] if p < len(cells) else '']
+
+def summary_rows(layout: Dict, rows: List[List[any]]) -> Iterator[List[any]]:
+    # each summarized var has a total row, labelled in col A, followed by a row per tab labelled in col B
+    offset = layout['pcol'] - 1
+    var = None
+    for cells in rows[1:]:
+        label = str(cells[0]) if len(cells) > 0 else ''
+        item = str(cells[1]).strip() if len(cells) > 1 else ''
+        if label != '':
+            var = label.split(consts.VAR_SUMMARY_METHOD_DELIMITER)[0]
+            var = var if var in layout['vars'] or label in layout['vars'] else None
+            item = 'total'
+        if var is None or item == '':
+            continue
+        for p in range(0, layout['periods']):
+            yield [layout['name'], var, item, p + 1, cells[offset + p] if offset + p < len(cells) else '']
+
+def export_results(spreadsheet: gspread.spreadsheet.Spreadsheet, layouts: List[Dict], path: str):
+    timer = Timer()
+    print(f'\n→ Exporting results of {len(layouts)} tab(s) to {path}...')
+    rows = result_rows(spreadsheet, layouts)
+    if path.lower().endswith('.parquet'):
+        count = write_parquet(path, rows)
+    else:
+        count = write_csv(path, rows)
+    print(f'✔ {count} row(s) exported. {timer.check()}')
+
+def write_csv(path: str, rows: Iterator[List[any]]) -> int:
+    count = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_parquet(path: str, rows: Iterator[List[any]], chunk_size: int = 50000) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        ensure(False, 'Exporting to Parquet needs pyarrow (pip install pyarrow). Export to .csv instead?')
+
+    schema = pa.schema([
+        ('tab', pa.string()),
+        ('variable', pa.string()),
+        ('item', pa.string()),
+        ('period', pa.int32()),
+        ('value', pa.float64())
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if len(chunk) == 0:
+                break
+            columns = list(zip(*chunk))
+            writer.write_table(pa.table([
+                list(columns[0]),
+                list(columns[1]),
+                [str(x) for x in columns[2]],
+                list(columns[3]),
+                # blanks and errors (e.g. #REF!) have no numeric value
+                [x if isinstance(x, (int, float)) else None for x in columns[4]]
+            ], schema=schema))
+            count += len(chunk)
+    return count
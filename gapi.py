@@ -1,16 +1,86 @@
-from typing import List, Tuple, Callable
+from typing import List, Tuple, Callable, Dict, ContextManager
+
+import re
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import gspread
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
+from utils import col_num_to_letter, ensure
 from timer import Timer
+import consts
+
+# set by the credential pool: the current account's service for an API, 'sheets' or 'drive', along
+# with a connection lent to the call, as a connection can't be shared between threads
+get_service: Callable[[str], ContextManager[Tuple[any, any]]] = None
+
+# set by a credential pool, to account for calls and fail over to another account when throttled
+before_call: Callable[[], None] = None
+on_throttled: Callable[[], None] = None
+# set by the run history, to record every batch sent: channel, request counts by type, bytes, seconds
+on_sent: Callable[[str, Dict[str, int], int, float], None] = None
 
-service: any
+def call(build_request: Callable[[any], any], channel: str = 'sheets') -> Dict:
+    """Executes a request built on the current account's service, retrying if throttled."""
+    for attempt in range(0, consts.THROTTLE_RETRIES + 1):
+        if before_call is not None:
+            before_call()
+        # each call borrows a connection, so the pipeline and the values channel can call at once
+        try:
+            with get_service('drive' if channel == 'drive' else 'sheets') as (svc, http):
+                return build_request(svc).execute(http=http)
+        except HttpError as e:
+            if e.resp.status != 429 or on_throttled is None or attempt == consts.THROTTLE_RETRIES:
+                raise
+            on_throttled()
+
+def copy_spreadsheet(spreadsheet: gspread.spreadsheet.Spreadsheet, name: str) -> str:
+    """
+    Copies the whole file through Drive, into the same folder as the original, and shares it with everyone
+    the original is shared with (the other accounts of a pool included). Returns the ID of the copy.
+    """
+    timer = Timer()
+    original = call(lambda svc: svc.files().get(fileId=spreadsheet.id, fields='parents,driveId', supportsAllDrives=True), 'drive')
+    body = {'name': name}
+    if original.get('parents'):
+        body['parents'] = original['parents']
+    try:
+        copy = call(lambda svc: svc.files().copy(fileId=spreadsheet.id, body=body, fields='id,owners(emailAddress)', supportsAllDrives=True), 'drive')
+    except HttpError as e:
+        # service accounts have no Drive storage of their own, so they can only create files in shared drives
+        ensure(e.resp.status != 403 or 'driveId' in original, f'"{spreadsheet.title}" could not be copied: outside a shared drive, the copy is owned by the service account, which needs Drive storage of its own. Move the book into a shared drive. ({e.reason})')
+        raise
+    if 'driveId' not in original:
+        # in a shared drive the copy is shared with the drive's members; elsewhere only with the account that made it
+        copy_permissions(spreadsheet.id, copy['id'], [o['emailAddress'] for o in copy.get('owners', [])])
+    print(f'  ✔ Copied to "{name}". {timer.check()}')
+    return copy['id']
 
-def set_service(svc):
-    global service
-    service = svc
+def copy_permissions(source_id: str, target_id: str, owners: List[str]):
+    """Shares a file with everyone another is shared with, the other's owner as an editor."""
+    permissions = call(lambda svc: svc.permissions().list(
+        fileId=source_id,
+        fields='permissions(type,role,emailAddress,domain,allowFileDiscovery)',
+        pageSize=100,
+        supportsAllDrives=True
+    ), 'drive').get('permissions', [])
+    for permission in permissions:
+        if permission.get('emailAddress') in owners:
+            continue
+        if permission['role'] == 'owner':
+            permission['role'] = 'writer'
+        call(lambda svc: svc.permissions().create(
+            fileId=target_id,
+            body=permission,
+            sendNotificationEmail=False,
+            supportsAllDrives=True
+        ), 'drive')
+
+def trash_file(file_id: str):
+    call(lambda svc: svc.files().update(fileId=file_id, body={'trashed': True}, supportsAllDrives=True), 'drive')
 
 # raw calls
 # request caching and flushing
@@ -23,25 +93,33 @@ def parse_cell_value(value):
     else:
         return {'stringValue': value}
 
-def read_ranges(spreadsheet: gspread.spreadsheet.Spreadsheet, ranges: List[str]):
+def value_range_rows(value_range: Dict) -> List[List[any]]:
+    # this assumes first row and first col are non-blank, otherwise it will lead to parsing issues downstream
+    if 'values' not in value_range:
+        return []
+    values = value_range['values']
+    if value_range['majorDimension'] == 'COLUMNS':
+        values = list(zip(*values))
+        values = [list(row) for row in values]
+    return values
+
+def batch_get(spreadsheet: gspread.spreadsheet.Spreadsheet, ranges: List[str], value_render_option: str) -> List[Dict]:
     timer = Timer()
-    result = service.spreadsheets().values().batchGet(
+    result = call(lambda svc: svc.spreadsheets().values().batchGet(
         spreadsheetId=spreadsheet.id,
-        ranges=ranges
-    ).execute()
-    response = {}
-    for value_range in result['valueRanges']:
-        # this assumes first row and first col are non-blank, otherwise it will lead to parsing issues downstream
-        if 'values' in value_range:
-            values = value_range['values']
-            if value_range['majorDimension'] == 'COLUMNS':
-                values = list(zip(*values))
-                values = [list(row) for row in values]
-        else:
-            values = []
-        response[value_range['range']] = values
+        ranges=ranges,
+        valueRenderOption=value_render_option
+    ))
     print(f'  ✔ {len(ranges)} range(s) read. {timer.check()}')
-    return response
+    return result['valueRanges']
+
+def read_value_ranges(spreadsheet: gspread.spreadsheet.Spreadsheet, ranges: List[str], value_render_option: str = 'FORMATTED_VALUE') -> List[List[List[any]]]:
+    """Rows of values of each range read, in the order requested, repeated ranges included."""
+    return [value_range_rows(value_range) for value_range in batch_get(spreadsheet, ranges, value_render_option)]
+
+def read_ranges(spreadsheet: gspread.spreadsheet.Spreadsheet, ranges: List[str], value_render_option: str = 'FORMATTED_VALUE') -> Dict[str, List[List[any]]]:
+    """Rows of values keyed by the range read, in the order requested."""
+    return {value_range['range']: value_range_rows(value_range) for value_range in batch_get(spreadsheet, ranges, value_render_option)}
 
 def update_cells(sheet: gspread.worksheet.Worksheet, startRow, startCol, vals):
     # vals is rows downward, and then across; each row must be of same length
@@ -66,6 +144,7 @@ def update_cells(sheet: gspread.worksheet.Worksheet, startRow, startCol, vals):
             }
         }
     ]
+    sheet_titles[sheet.id] = sheet.title
     queue_requests(requests)
 
 def delete_tab(sheet: gspread.worksheet.Worksheet):
@@ -93,6 +172,43 @@ def update_tab_color(sheet: gspread.worksheet.Worksheet | str, color):
     ]
     queue_requests(requests)
 
+def update_tab_properties(sheet: gspread.worksheet.Worksheet, properties: Dict):
+    requests = [
+        {
+            'updateSheetProperties': {
+                'properties': dict(properties, sheetId=sheet.id),
+                'fields': ','.join(properties.keys())
+            }
+        }
+    ]
+    queue_requests(requests)
+
+def clear_tab(sheet: gspread.worksheet.Worksheet, rows: int, cols: int):
+    """Clears the values and formats of a tab, and resizes its grid."""
+    requests = [
+        {
+            'updateCells': {
+                'range': {
+                    'sheetId': sheet.id
+                },
+                'fields': '*'
+            }
+        },
+        {
+            'updateSheetProperties': {
+                'properties': {
+                    'sheetId': sheet.id,
+                    'gridProperties': {
+                        'rowCount': rows,
+                        'columnCount': cols
+                    }
+                },
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+            }
+        }
+    ]
+    queue_requests(requests)
+
 def insert_column(sheet: gspread.worksheet.Worksheet, sourceCol: int, times: int = 1):
     requests = [
         # Request to insert a new column at index 1 (B)
@@ -199,6 +315,81 @@ def duplicate_column(sheet: gspread.worksheet.Worksheet, sourceCol: int, times:
     ]
     queue_requests(requests)
 
+def fill_right(sheet: gspread.worksheet.Worksheet, startRow: int, startCol: int, rows: int, times: int):
+    """Has the server copy a seed column of cells into the next `times` columns; relative refs shift as they would in the UI."""
+    if times <= 0:
+        return
+    requests = [
+        {
+            "copyPaste": {
+                "source": {
+                    "sheetId": sheet.id,
+                    "startRowIndex": startRow - 1,
+                    "endRowIndex": startRow - 1 + rows,
+                    "startColumnIndex": startCol - 1,
+                    "endColumnIndex": startCol
+                },
+                "destination": {
+                    "sheetId": sheet.id,
+                    "startRowIndex": startRow - 1,
+                    "endRowIndex": startRow - 1 + rows,
+                    "startColumnIndex": startCol,
+                    "endColumnIndex": startCol + times
+                },
+                "pasteType": "PASTE_FORMULA"
+            }
+        }
+    ]
+    queue_requests(requests)
+
+def fill_down(sheet: gspread.worksheet.Worksheet, startRow: int, startCol: int, cols: int, times: int):
+    """Has the server copy a seed row of cells into the next `times` rows; relative refs shift as they would in the UI."""
+    if times <= 0:
+        return
+    requests = [
+        {
+            "copyPaste": {
+                "source": {
+                    "sheetId": sheet.id,
+                    "startRowIndex": startRow - 1,
+                    "endRowIndex": startRow,
+                    "startColumnIndex": startCol - 1,
+                    "endColumnIndex": startCol - 1 + cols
+                },
+                "destination": {
+                    "sheetId": sheet.id,
+                    "startRowIndex": startRow,
+                    "endRowIndex": startRow + times,
+                    "startColumnIndex": startCol - 1,
+                    "endColumnIndex": startCol - 1 + cols
+                },
+                "pasteType": "PASTE_FORMULA"
+            }
+        }
+    ]
+    queue_requests(requests)
+
+def repeat_value(sheet: gspread.worksheet.Worksheet, startRow: int, startCol: int, rows: int, cols: int, value):
+    """Sets every cell in the range to the same value, sent once rather than per cell."""
+    requests = [
+        {
+            "repeatCell": {
+                "range": {
+                    "sheetId": sheet.id,
+                    "startRowIndex": startRow - 1,
+                    "endRowIndex": startRow - 1 + rows,
+                    "startColumnIndex": startCol - 1,
+                    "endColumnIndex": startCol - 1 + cols
+                },
+                "cell": {
+                    "userEnteredValue": parse_cell_value(value)
+                },
+                "fields": "userEnteredValue"
+            }
+        }
+    ]
+    queue_requests(requests)
+
 def duplicate_row(sheet: gspread.worksheet.Worksheet, sourceRow: int, times: int = 1):
     if times == 0:
         return
@@ -238,7 +429,7 @@ def duplicate_row(sheet: gspread.worksheet.Worksheet, sourceRow: int, times: int
     ]
     queue_requests(requests)
 
-def duplicate_tab(sheet: gspread.worksheet.Worksheet, new_sheet_name: str, index: int, after: Callable = None):
+def duplicate_tab(sheet: gspread.worksheet.Worksheet, new_sheet_name: str, index: int, after: Callable = None, new_sheet_id: int = None):
     requests = [
         {
             'duplicateSheet': {
@@ -248,47 +439,367 @@ def duplicate_tab(sheet: gspread.worksheet.Worksheet, new_sheet_name: str, index
             }
         }
     ]
+    if new_sheet_id is not None:
+        requests[0]['duplicateSheet']['newSheetId'] = new_sheet_id
     queue_requests(requests, [after])
 
+def add_tab(sheet_id: int, title: str, rows: int, cols: int, index: int = None):
+    properties = {
+        'sheetId': sheet_id,
+        'title': title,
+        'gridProperties': {
+            'rowCount': rows,
+            'columnCount': cols
+        }
+    }
+    if index is not None:
+        properties['index'] = index
+    requests = [
+        {
+            'addSheet': {
+                'properties': properties
+            }
+        }
+    ]
+    queue_requests(requests)
+
+def create_metadata(sheet: gspread.worksheet.Worksheet, key: str, value: str, dimension: str = None, start: int = None, end: int = None):
+    """
+    Developer metadata on a tab, or on a range of its rows or columns (1-based, inclusive), which
+    moves along with them as rows or columns are inserted or deleted around it.
+    """
+    if dimension is None:
+        location = {'sheetId': sheet.id}
+    else:
+        location = {
+            'dimensionRange': {
+                'sheetId': sheet.id,
+                'dimension': dimension,
+                'startIndex': start - 1,
+                'endIndex': end
+            }
+        }
+    requests = [
+        {
+            'createDeveloperMetadata': {
+                'developerMetadata': {
+                    'metadataKey': key,
+                    'metadataValue': value,
+                    'location': location,
+                    'visibility': 'DOCUMENT'
+                }
+            }
+        }
+    ]
+    queue_requests(requests)
+
+def search_metadata(spreadsheet: gspread.spreadsheet.Spreadsheet, keys: List[str]) -> List[Dict]:
+    """All developer metadata under any of the keys, with their current locations, in one call."""
+    timer = Timer()
+    result = call(lambda svc: svc.spreadsheets().developerMetadata().search(
+        spreadsheetId=spreadsheet.id,
+        body={'dataFilters': [{'developerMetadataLookup': {'metadataKey': key}} for key in keys]}
+    ))
+    matches = [m['developerMetadata'] for m in result.get('matchedDeveloperMetadata', [])]
+    print(f'  ✔ {len(matches)} metadata entries found. {timer.check()}')
+    return matches
+
 request_queue: List[any] = []
 callback_queue: List[Callable] = []
+queued_cells = 0
+sheet_titles: Dict[int, str] = {} # of the tabs written to, for values channel ranges
 def queue_requests(requests, callbacks: List[Callable] = None):
     global request_queue
     global callback_queue
+    global queued_cells
 
     if callbacks == None:
         callbacks = [None] * len(requests)
 
     request_queue.extend(requests)
     callback_queue.extend(callbacks)
+    for req in requests:
+        if 'updateCells' in req:
+            queued_cells += sum(len(row['values']) for row in req['updateCells'].get('rows', []))
 
-def flush_requests(spreadsheet: gspread.spreadsheet.Spreadsheet):
+def take_requests() -> Tuple[List[any], List[Callable]]:
     global request_queue
     global callback_queue
+    global queued_cells
+    requests, callbacks = request_queue, callback_queue
+    request_queue = []
+    callback_queue = []
+    queued_cells = 0
+    return requests, callbacks
 
-    global service
+def discard_requests():
+    """Drops anything still queued, e.g. from a run that failed partway, so it doesn't leak into the next one."""
+    take_requests()
 
-    if len(request_queue) == 0:
-        print('No commands queued to flush.')
-        return
-    
-    print(f'→ Executing {len(request_queue)} queued command(s)...')
+def execute_requests(spreadsheet: gspread.spreadsheet.Spreadsheet, requests: List[any], callbacks: List[Callable]) -> Dict:
+    print(f'→ Executing {len(requests)} queued command(s)...')
     if False: # set to True for verbose output
-        print(f'  {[list(req.keys())[0] for req in request_queue]}')
+        print(f'  {[list(req.keys())[0] for req in requests]}')
     # Execute the requests
     body = {
-        'requests': request_queue
+        'requests': requests
     }
 
     timer = Timer()
-    response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet.id, body=body).execute()
+    response = call(lambda svc: svc.spreadsheets().batchUpdate(spreadsheetId=spreadsheet.id, body=body))
+    if on_sent is not None:
+        on_sent('sheets', request_types(requests), len(json.dumps(body)), timer.elapsed())
 
     for i, reply in enumerate(response['replies']):
-        if callback_queue[i] is not None:
-            callback_queue[i](reply)
+        if callbacks[i] is not None:
+            callbacks[i](reply)
 
     print(f'✔ ...done executing. {timer.check()}')
-    
-    request_queue = []
-    callback_queue = []
-    
\ No newline at end of file
+    return response
+
+def flush_requests(spreadsheet: gspread.spreadsheet.Spreadsheet):
+    if pipeline is not None:
+        # anything already dispatched has to land first
+        pipeline.wait()
+    if len(request_queue) == 0:
+        print('No commands queued to flush.')
+        return None
+    return execute_requests(spreadsheet, *take_requests())
+
+def request_types(requests: List[Dict]) -> Dict[str, int]:
+    types: Dict[str, int] = {}
+    for req in requests:
+        kind = list(req.keys())[0]
+        types[kind] = types.get(kind, 0) + 1
+    return types
+
+def request_sheet_ids(request: Dict) -> set:
+    """Every tab a request touches, wherever the sheet ID sits in it."""
+    ids = set()
+    pending = [request]
+    while len(pending) > 0:
+        item = pending.pop()
+        if isinstance(item, dict):
+            for key, value in item.items():
+                if key in ['sheetId', 'sourceSheetId', 'newSheetId'] and isinstance(value, int):
+                    ids.add(value)
+                else:
+                    pending.append(value)
+        elif isinstance(item, list):
+            pending.extend(item)
+    return ids
+
+def request_titles(request: Dict) -> Dict[int, str]:
+    """Titles given to tabs by a request, e.g. by duplicating or renaming."""
+    kind = list(request.keys())[0]
+    if kind == 'duplicateSheet' and 'newSheetId' in request[kind]:
+        return {request[kind]['newSheetId']: request[kind]['newSheetName']}
+    if kind in ['addSheet', 'updateSheetProperties'] and 'title' in request[kind]['properties']:
+        return {request[kind]['properties']['sheetId']: request[kind]['properties']['title']}
+    return {}
+
+def is_value_write(request: Dict) -> bool:
+    return 'updateCells' in request and 'start' in request['updateCells'] and request['updateCells']['fields'] == 'userEnteredValue'
+
+def value_range(request: Dict) -> Dict:
+    """
+    An updateCells request as a values.batchUpdate range, if it only writes numbers and formulas,
+    which are entered the same either way. Strings are left alone, since entering them would parse them.
+    """
+    update = request['updateCells']
+    rows: List[List[any]] = []
+    for row in update['rows']:
+        cells = []
+        for cell in row['values']:
+            value = cell['userEnteredValue']
+            if 'formulaValue' in value:
+                cells.append(value['formulaValue'])
+            elif 'numberValue' in value:
+                cells.append(value['numberValue'])
+            else:
+                return None
+        rows.append(cells)
+    if len(rows) == 0 or update['start']['sheetId'] not in sheet_titles:
+        return None
+    title = sheet_titles[update['start']['sheetId']].replace("'", "''")
+    row, col = update['start']['rowIndex'] + 1, update['start']['columnIndex'] + 1
+    end_row, end_col = row + len(rows) - 1, col + max(len(r) for r in rows) - 1
+    return {
+        'range': f"'{title}'!{col_num_to_letter(col)}{row}:{col_num_to_letter(end_col)}{end_row}",
+        'values': rows
+    }
+
+class Pipeline:
+    """
+    Sends batches on a background thread, one at a time and in the order they were cut, so the
+    next requests can be built while the previous batch is in flight. A batch that fails stops
+    everything after it; the error is raised on the next dispatch or wait.
+
+    Plain value writes to tabs whose structure is settled, i.e. with no structural requests
+    queued or in flight, go through values.batchUpdate on a second channel instead, alongside
+    the structural batches. A structural batch waits for the value writes to the tabs it touches
+    before it is sent, and a batch is only recorded once both of its parts have landed.
+    """
+    def __init__(self, spreadsheet: gspread.spreadsheet.Spreadsheet, on_cut: Callable[[], any] = None, on_done: Callable[[Dict, any], None] = None):
+        self.spreadsheet = spreadsheet
+        self.on_cut = on_cut
+        self.on_done = on_done
+        self.batches = queue.Queue()
+        self.error: Exception = None
+        self.lock = threading.Lock()
+        self.unsettled: Dict[int, int] = {} # sheet ID -> structural batches still to land that touch it
+        self.unsettled_titles: Dict[int, str] = {}
+        self.value_calls: List[Tuple[Future, set, bool]] = [] # in flight, the tabs written, whether any formulas
+        self.values = ThreadPoolExecutor(max_workers=1)
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def dispatch(self, requests: List[any], callbacks: List[Callable]):
+        self.raise_error()
+        # whatever the batch needs to be recorded with is taken now, not when it lands
+        token = None if self.on_cut is None else self.on_cut()
+        requests, callbacks, data, value_sheets = self.split(requests, callbacks)
+
+        structural_sheets = set()
+        for req in requests:
+            structural_sheets |= request_sheet_ids(req)
+        with self.lock:
+            for sheet_id in structural_sheets:
+                self.unsettled[sheet_id] = self.unsettled.get(sheet_id, 0) + 1
+            for req in requests:
+                self.unsettled_titles.update(request_titles(req))
+            # earlier value writes to these tabs have to land before the structure changes, and so do
+            # earlier formulas, which may refer to these tabs and need to be shifted along with them
+            self.value_calls = [c for c in self.value_calls if not c[0].done()]
+            waits = [f for f, sheets, formulas in self.value_calls if formulas or len(sheets & structural_sheets) > 0]
+
+        value_call = None
+        if len(data) > 0:
+            value_call = self.values.submit(self.write_values, data)
+            formulas = any(isinstance(v, str) for d in data for row in d['values'] for v in row)
+            self.value_calls.append((value_call, value_sheets, formulas))
+        self.batches.put((requests, callbacks, structural_sheets, waits, value_call, token))
+
+    def split(self, requests: List[any], callbacks: List[Callable]) -> Tuple[List[any], List[Callable], List[Dict], set]:
+        """Takes out the value writes that can go through the values channel."""
+        if self.values is None:
+            return requests, callbacks, [], set()
+        batch_sheets = set()
+        batch_titles = set()
+        for req in requests:
+            if not is_value_write(req):
+                batch_sheets |= request_sheet_ids(req)
+                batch_titles |= set(request_titles(req).values())
+        with self.lock:
+            unsettled = set(i for i, count in self.unsettled.items() if count > 0) | batch_sheets
+            unsettled_titles = set(t for i, t in self.unsettled_titles.items() if i in unsettled) | batch_titles
+        unsettled_titles |= set(sheet_titles[i] for i in unsettled if i in sheet_titles)
+
+        kept_requests, kept_callbacks, data, value_sheets = [], [], [], set()
+        for req, callback in zip(requests, callbacks):
+            sheet_id = req['updateCells']['start']['sheetId'] if is_value_write(req) else None
+            values = None if sheet_id is None or sheet_id in unsettled or callback is not None else value_range(req)
+            # formulas must not point at tabs still being created or reshaped
+            if values is not None and any(
+                title.replace("''", "'") in unsettled_titles
+                for row in values['values'] for v in row if isinstance(v, str)
+                for title in re.findall(r"'((?:[^']|'')+)'!", v)
+            ):
+                values = None
+            if values is None:
+                kept_requests.append(req)
+                kept_callbacks.append(callback)
+            else:
+                data.append(values)
+                value_sheets.add(sheet_id)
+        return kept_requests, kept_callbacks, data, value_sheets
+
+    def write_values(self, data: List[Dict]) -> Dict:
+        if self.error is not None:
+            return None
+        timer = Timer()
+        body = {'valueInputOption': 'USER_ENTERED', 'data': data}
+        response = call(lambda svc: svc.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet.id,
+            body=body
+        ), 'values')
+        if on_sent is not None:
+            on_sent('values', {'valueRange': len(data)}, len(json.dumps(body)), timer.elapsed())
+        print(f'✔ {len(data)} value range(s) written. {timer.check()}')
+        return response
+
+    def work(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                self.batches.task_done()
+                return
+            requests, callbacks, structural_sheets, waits, value_call, token = batch
+            try:
+                if self.error is None:
+                    for f in waits:
+                        f.result()
+                    response = execute_requests(self.spreadsheet, requests, callbacks) if len(requests) > 0 else {'replies': []}
+                    with self.lock:
+                        for sheet_id in structural_sheets:
+                            self.unsettled[sheet_id] -= 1
+                    if value_call is not None:
+                        value_call.result()
+                    if self.on_done is not None:
+                        self.on_done(response, token)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.batches.task_done()
+
+    def wait(self):
+        self.batches.join()
+        self.raise_error()
+
+    def raise_error(self):
+        # the error sticks: nothing is dispatched after a failed batch, and what was already
+        # queued behind it is drained without being sent
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.batches.put(None)
+        self.thread.join()
+        if self.values is not None:
+            self.values.shutdown(wait=True)
+
+pipeline: Pipeline = None
+def start_pipeline(spreadsheet: gspread.spreadsheet.Spreadsheet, on_cut: Callable[[], any] = None, on_done: Callable[[Dict, any], None] = None):
+    """From here on, the queue is sent in the background whenever it reaches the auto-flush thresholds between steps."""
+    global pipeline
+    stop_pipeline()
+    pipeline = Pipeline(spreadsheet, on_cut, on_done)
+
+def stop_pipeline():
+    """Waits for the batches in flight, without sending what is still queued."""
+    global pipeline
+    if pipeline is None:
+        return
+    stopped, pipeline = pipeline, None
+    stopped.batches.join()
+    stopped.stop()
+
+def dispatch_requests():
+    """Cuts the queue into a batch for the pipeline, without waiting for it."""
+    if len(request_queue) == 0:
+        return
+    pipeline.dispatch(*take_requests())
+
+def dispatch_full_requests():
+    """
+    Cuts a batch once the queue reaches the auto-flush thresholds. Only called between steps, so
+    that every batch ends on a step boundary and the checkpoint it is recorded with is where a
+    resumed run can safely pick up.
+    """
+    if pipeline is not None and (len(request_queue) >= consts.AUTO_FLUSH_REQUESTS or queued_cells >= consts.AUTO_FLUSH_CELLS):
+        dispatch_requests()
+
+def drain_requests():
+    """Sends what is queued and waits for every batch in flight; a barrier for anything that needs the replies."""
+    dispatch_requests()
+    pipeline.wait()
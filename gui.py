@@ -5,7 +5,7 @@ import os
 import re
 
 from sheet import initialize_sheets, Sheet
-from commands import Command
+from commands import run_steps
 from timer import Timer
 
 def url_changed(*args):
@@ -51,14 +51,7 @@ def run_commands():
     initialize_sheets(credentials_path)
     sheet = Sheet(g_id)
 
-    cmd = sheet.steps_tab.read_next_command()
-    while cmd is not None:
-        Command(cmd).exec(sheet)
-        cmd = sheet.steps_tab.read_next_command()
-
-    sheet.summarize()
-
-    sheet.flush()
+    run_steps(sheet)
 
     print(f'\n✔ Done {timer.check()}')
 
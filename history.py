@@ -0,0 +1,169 @@
+from typing import List, Dict, Tuple
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from statistics import median
+
+import gapi
+import consts
+
+# Local SQLite store of every run's size and timings, to catch runs and steps that got slower
+# than they used to be for the same book, e.g. after a template change or a library update.
+
+SCHEMA = '''
+create table if not exists runs (
+    id integer primary key,
+    spreadsheet text not null,
+    started real not null,
+    seconds real not null,
+    ok integer not null,
+    steps integer not null,
+    tabs integer not null,
+    vars integer not null,
+    periods integer not null,
+    batches integer not null,
+    requests integer not null,
+    bytes integer not null,
+    request_types text not null
+);
+create table if not exists steps (
+    run integer not null references runs(id),
+    position integer not null,
+    step text not null,
+    seconds real not null
+);
+create table if not exists flushes (
+    run integer not null references runs(id),
+    position integer not null,
+    channel text not null,
+    requests integer not null,
+    bytes integer not null,
+    seconds real not null
+);
+create index if not exists runs_by_spreadsheet on runs(spreadsheet, started);
+'''
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(consts.JOURNAL_DIR, exist_ok=True)
+    # scenario copies are run in parallel processes, each recording its own run
+    db = sqlite3.connect(os.path.join(consts.JOURNAL_DIR, consts.HISTORY_FILE), timeout=30)
+    db.executescript(SCHEMA)
+    return db
+
+class RunHistory:
+    """Timings of one run, collected as it goes and stored once it ends."""
+    def __init__(self, spreadsheet_id: str):
+        self.spreadsheet_id = spreadsheet_id
+        self.lock = threading.Lock() # batches are sent from the pipeline's threads
+        self.steps: List[Tuple[int, str, float]] = []
+        self.flushes: List[Tuple[str, int, int, float]] = []
+        self.request_types: Dict[str, int] = {}
+        self.started = None
+
+    def start(self):
+        self.started = time.time()
+        gapi.on_sent = self.sent
+
+    def step(self, position: int, args: List[str], seconds: float):
+        self.steps.append((position, ' '.join(args), seconds))
+
+    def sent(self, channel: str, request_types: Dict[str, int], size: int, seconds: float):
+        with self.lock:
+            self.flushes.append((channel, sum(request_types.values()), size, seconds))
+            for kind, count in request_types.items():
+                self.request_types[kind] = self.request_types.get(kind, 0) + count
+
+    def finish(self, tabs: int, vars: int, periods: int, ok: bool = True):
+        if gapi.on_sent == self.sent:
+            gapi.on_sent = None
+        if self.started is None:
+            return
+        with self.lock, connect() as db:
+            run = db.execute(
+                'insert into runs (spreadsheet, started, seconds, ok, steps, tabs, vars, periods, batches, requests, bytes, request_types) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    self.spreadsheet_id, self.started, time.time() - self.started, int(ok),
+                    len(self.steps), tabs, vars, periods,
+                    len(self.flushes), sum(f[1] for f in self.flushes), sum(f[2] for f in self.flushes),
+                    json.dumps(self.request_types)
+                )
+            ).lastrowid
+            db.executemany('insert into steps (run, position, step, seconds) values (?, ?, ?, ?)', [(run, *s) for s in self.steps])
+            db.executemany('insert into flushes (run, position, channel, requests, bytes, seconds) values (?, ?, ?, ?, ?, ?)', [(run, i + 1, *f) for i, f in enumerate(self.flushes)])
+        db.close()
+
+def read_runs(db: sqlite3.Connection, spreadsheet_id: str) -> List[Dict]:
+    db.row_factory = sqlite3.Row
+    runs = [dict(r) for r in db.execute('select * from runs where spreadsheet = ? order by started', (spreadsheet_id,))]
+    steps: Dict[int, Dict[str, float]] = {}
+    for r in db.execute('select steps.* from steps join runs on runs.id = steps.run where spreadsheet = ? order by position', (spreadsheet_id,)):
+        # the same step may be repeated; each repeat is told apart by its occurrence
+        run_steps = steps.setdefault(r['run'], {})
+        key = r['step']
+        n = 1
+        while key in run_steps:
+            n += 1
+            key = f'{r["step"]} #{n}'
+        run_steps[key] = r['seconds']
+    for run in runs:
+        run['step_seconds'] = steps.get(run['id'], {})
+    return runs
+
+def slower(seconds: float, baseline: List[float]) -> bool:
+    """Meaningfully slower: by a factor over the median of the baseline, and by a noticeable margin."""
+    if len(baseline) < consts.HISTORY_MIN_BASELINE:
+        return False
+    base = median(baseline)
+    return seconds > base * consts.HISTORY_SLOWDOWN and seconds - base > consts.HISTORY_MIN_SLOWDOWN
+
+def baseline_runs(runs: List[Dict], i: int) -> List[Dict]:
+    """The successful runs before the i-th, at most HISTORY_BASELINE_RUNS of them."""
+    return [r for r in runs[:i] if r['ok']][-consts.HISTORY_BASELINE_RUNS:]
+
+def regressions(runs: List[Dict], i: int) -> List[Tuple[str, float, float]]:
+    """Steps of the i-th run slower than their own baseline, as (step, seconds, baseline median)."""
+    baseline = baseline_runs(runs, i)
+    found = []
+    for step, seconds in runs[i]['step_seconds'].items():
+        times = [r['step_seconds'][step] for r in baseline if step in r['step_seconds']]
+        if slower(seconds, times):
+            found.append((step, seconds, median(times)))
+    return sorted(found, key=lambda f: f[2] - f[1])
+
+def report(spreadsheet_id: str = None, last: int = 10):
+    db = connect()
+    if spreadsheet_id is None:
+        print(f'  {"Spreadsheet":<46}{"Runs":>6}  {"Last run":<18}{"Seconds":>9}')
+        for r in db.execute('select spreadsheet, count(*), max(started), (select seconds from runs l where l.spreadsheet = runs.spreadsheet order by started desc limit 1) from runs group by spreadsheet order by max(started) desc'):
+            print(f'  {r[0]:<46}{r[1]:>6}  {time.strftime("%Y-%m-%d %H:%M", time.localtime(r[2])):<18}{r[3]:>9.1f}')
+        db.close()
+        return
+
+    runs = read_runs(db, spreadsheet_id)
+    db.close()
+    if len(runs) == 0:
+        print(f'! No runs recorded for {spreadsheet_id}.')
+        return
+
+    print(f'  {"Run":<18}{"Seconds":>9}{"Steps":>7}{"Tabs":>6}{"Vars":>7}{"Periods":>8}{"Batches":>8}{"Requests":>10}{"KB sent":>9}')
+    first = max(0, len(runs) - last)
+    for i in range(first, len(runs)):
+        r = runs[i]
+        baseline = [b['seconds'] for b in baseline_runs(runs, i)]
+        flag = '  ! failed' if not r['ok'] else f'  ! slower than usual ({median(baseline):.1f}s)' if slower(r['seconds'], baseline) else ''
+        print(f'  {time.strftime("%Y-%m-%d %H:%M", time.localtime(r["started"])):<18}{r["seconds"]:>9.1f}{r["steps"]:>7}{r["tabs"]:>6}{r["vars"]:>7}{r["periods"]:>8}{r["batches"]:>8}{r["requests"]:>10,}{r["bytes"] / 1024:>9,.0f}{flag}')
+
+    latest = runs[-1]
+    types = json.loads(latest['request_types'])
+    if len(types) > 0:
+        print(f'\n→ Requests of the last run: {", ".join(f"{k} {v:,}" for k, v in sorted(types.items(), key=lambda x: -x[1]))}')
+
+    for i in range(first, len(runs)):
+        found = regressions(runs, i)
+        if len(found) > 0:
+            print(f'\n! Steps slower than usual in the run of {time.strftime("%Y-%m-%d %H:%M", time.localtime(runs[i]["started"]))}:')
+            for step, seconds, base in found:
+                print(f'  {step}: {seconds:.2f}s, usually {base:.2f}s')
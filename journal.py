@@ -0,0 +1,95 @@
+from typing import List, Dict
+
+import os
+import json
+import hashlib
+
+import consts
+
+def steps_hash(steps: List[List[str]]) -> str:
+    return hashlib.sha1(json.dumps(steps).encode('utf-8')).hexdigest()
+
+class Journal:
+    """
+    Local, append-only record of a run: one line per flushed batch, with the new tabs it created
+    and the state of the run as of the start of the step that was in progress when it was flushed.
+    If a run dies, everything up to the last recorded batch is already in the spreadsheet, so a
+    resumed run only needs to restore that state and carry on from its steps cursor.
+    """
+    def __init__(self, spreadsheet_id: str):
+        self.path = os.path.join(consts.JOURNAL_DIR, f'{spreadsheet_id}.jsonl')
+        self.pending: Dict = None
+        self.batches = 0
+
+    def read(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # a torn last line from a crash mid-write; everything before it still stands
+                    break
+        return entries
+
+    def resume_point(self) -> Dict:
+        """Last committed batch of an unfinished run, or None if there is nothing to resume."""
+        entries = self.read()
+        if len(entries) == 0 or entries[-1]['event'] == 'complete':
+            return None
+        start = next((e for e in reversed(entries) if e['event'] == 'start'), None)
+        batch = next((e for e in reversed(entries) if e['event'] == 'batch' and e['state'] is not None), None)
+        if start is None or batch is None:
+            return None
+        return {
+            'steps_hash': start['steps_hash'],
+            'cursor': batch['cursor'],
+            'state': batch['state']
+        }
+
+    def start(self, steps_hash: str):
+        os.makedirs(consts.JOURNAL_DIR, exist_ok=True)
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'event': 'start', 'steps_hash': steps_hash}) + '\n')
+
+    def resume(self, cursor: int):
+        self.append({'event': 'resume', 'cursor': cursor})
+
+    def checkpoint(self, cursor: int, state: Dict):
+        """Called at the start of every step; becomes durable once a batch is flushed after it."""
+        self.pending = {'cursor': cursor, 'state': state}
+
+    def cut(self) -> Dict:
+        """The checkpoint a batch is recorded with, taken when the batch is cut rather than when it lands."""
+        return self.pending
+
+    def record_batch(self, response: Dict, pending: Dict):
+        self.batches += 1
+        new_tabs = [
+            {
+                'id': reply['duplicateSheet']['properties']['sheetId'],
+                'title': reply['duplicateSheet']['properties']['title']
+            }
+            for reply in response['replies'] if 'duplicateSheet' in reply
+        ]
+        self.append({
+            'event': 'batch',
+            'batch': self.batches,
+            'requests': len(response['replies']),
+            'new_tabs': new_tabs,
+            'cursor': None if pending is None else pending['cursor'],
+            'state': None if pending is None else pending['state']
+        })
+
+    def complete(self):
+        self.append({'event': 'complete'})
+
+    def append(self, entry: Dict):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
@@ -1,25 +1,115 @@
-from sheet import initialize_sheets, Sheet
-from commands import Command
+from sheet import initialize_sheets, open_spreadsheet, Sheet
+from commands import run_steps
+from export import export_results, layouts_from_sheet, layouts_from_book
+from consolidate import consolidate
+from recalc import report
+import history
+from plan import prune
+from shard import run_steps_sharded
+from scenario import run_scenarios
+from utils import ensure
 from timer import Timer
-import os
+import accounts
+import consts
+from typing import List
 
-os.system('cls' if os.name == 'nt' else 'clear')
+import multiprocessing
+import argparse
+import sys
+import os
 
 id_orig =       '1abQSainHd7j44v2Wq8EToCS_5v22rMekwJcUu19mjtE'
 id_base =       '1s0Cnb5o2vbXAYZinCbsMEYx5vIS7JlHrxAsVB2cjqtU'
 id_aggressive = '1MB_DtVpHV5wImG3_qUj6nwdwxS72zta-wD4D8URe2NY'
 
-timer = Timer()
-initialize_sheets('./credentials.json')
-sheet = Sheet(id_orig)
+def with_default_command(argv: List[str], commands: List[str]) -> List[str]:
+    """
+    Arguments without a command are for `run`, as they were before there were commands,
+    e.g. `main.py [spreadsheet id] --resume`. The command goes after the global --credentials.
+    """
+    i = 0
+    if i < len(argv) and argv[i].startswith('--credentials='):
+        i += 1
+    elif i < len(argv) and argv[i] == '--credentials':
+        i += 1
+        while i < len(argv) and not argv[i].startswith('-') and os.path.exists(argv[i]):
+            i += 1
+    if i < len(argv) and argv[i] in commands + ['-h', '--help']:
+        return argv
+    return argv[:i] + ['run'] + argv[i:]
+
+def main():
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+    parser = argparse.ArgumentParser(description='Cascading Forecasts')
+    parser.add_argument('--credentials', nargs='+', default=['./credentials.json'], help='service account credentials file(s), or directories of them, to spread the API quota over')
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser('run', help='run the steps of a spreadsheet (default)')
+    run_parser.add_argument('spreadsheet', nargs='?', default=id_orig, help='ID of the Google Sheet to run')
+    run_parser.add_argument('--resume', action='store_true', help='pick up an interrupted run after its last committed batch')
+    run_parser.add_argument('--prune', action='store_true', help='skip generated tabs that cannot reach the summary')
+    run_parser.add_argument('--export', metavar='PATH', help='export the results to a .csv or .parquet file after the run')
+    run_parser.add_argument('--shard', action='store_true', help='split generated tabs across copies of the book if it would be too big')
+    run_parser.add_argument('--shard-cells', type=int, metavar='N', help='cells allowed per book when sharding')
+
+    export_parser = commands.add_parser('export', help='export the results of a finished run')
+    export_parser.add_argument('spreadsheet', help='ID of the Google Sheet')
+    export_parser.add_argument('path', help='.csv or .parquet file to write')
+
+    consolidate_parser = commands.add_parser('consolidate', help='consolidate the summaries of several books into one')
+    consolidate_parser.add_argument('target', help='ID of the Google Sheet to write the consolidated summary to')
+    consolidate_parser.add_argument('sources', nargs='+', help='IDs of the Google Sheets to consolidate')
+
+    scenarios_parser = commands.add_parser('scenarios', help='run the base steps, then each scenario in its own copy of the book')
+    scenarios_parser.add_argument('spreadsheet', help='ID of the Google Sheet')
+    scenarios_parser.add_argument('names', nargs='*', help='scenarios to run (all by default)')
+    scenarios_parser.add_argument('--workers', type=int, help='scenarios run at once (all by default)')
+
+    profile_parser = commands.add_parser('profile', help='report what makes a finished book slow to recalculate')
+    profile_parser.add_argument('spreadsheet', help='ID of the Google Sheet')
+    profile_parser.add_argument('--top', type=int, default=10, help='cells to list for each hotspot')
+
+    history_parser = commands.add_parser('history', help='show the recorded runs of a spreadsheet, flagging slowdowns')
+    history_parser.add_argument('spreadsheet', nargs='?', help='ID of the Google Sheet (all recorded books if omitted)')
+    history_parser.add_argument('--last', type=int, default=10, help='runs to show')
+
+    args = parser.parse_args(with_default_command(sys.argv[1:], list(commands.choices)))
 
-cmd = sheet.steps_tab.read_next_command()
-while cmd is not None:
-    Command(cmd).exec(sheet)
-    cmd = sheet.steps_tab.read_next_command()
+    timer = Timer()
+    if args.command != 'history':
+        # the history is local, and needs no credentials
+        initialize_sheets(args.credentials)
 
-sheet.summarize()
+    match args.command:
+        case 'run':
+            sheet = Sheet(args.spreadsheet, resume=args.resume)
+            prune(sheet, args.prune)
+            if args.shard:
+                ensure(not args.resume, 'A resumed run cannot be sharded.')
+                run_steps_sharded(sheet, args.shard_cells or consts.SHARD_MAX_CELLS)
+            else:
+                run_steps(sheet)
+            if args.export is not None:
+                export_results(sheet.ref, layouts_from_sheet(sheet), args.export)
+        case 'export':
+            spreadsheet = open_spreadsheet(args.spreadsheet)
+            export_results(spreadsheet, layouts_from_book(spreadsheet), args.path)
+        case 'consolidate':
+            consolidate(args.target, args.sources)
+        case 'scenarios':
+            run_scenarios(Sheet(args.spreadsheet), args.credentials, args.names, args.workers)
+        case 'profile':
+            report(open_spreadsheet(args.spreadsheet), args.top)
+        case 'history':
+            history.report(args.spreadsheet, args.last)
 
-sheet.flush()
+    if len(accounts.pool) > 1:
+        for usage in accounts.usage():
+            print(f'  {usage["account"]}: {usage["calls"]} call(s), throttled {usage["throttled"]} time(s).')
+    print(f'\n✔ Done {timer.check()}')
 
-print(f'\n✔ Done {timer.check()}')
\ No newline at end of file
+if __name__ == '__main__':
+    # scenarios run in spawned processes, which import this module again; so does a frozen build
+    multiprocessing.freeze_support()
+    main()
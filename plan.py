@@ -0,0 +1,86 @@
+from typing import List, Dict, Tuple
+
+from sheet import Sheet
+from commands import matrix_variants
+from timer import Timer
+import consts
+
+def walk_steps(sheet: Sheet) -> Tuple[List[Tuple[str, str, int]], Dict[str, set], Dict[str, set]]:
+    """
+    Follows the spawn/build/matrix/map steps without running them. Returns the generated tabs in order,
+    as (name, source tab, periods at the time), the tabs each one is spawned or mapped from,
+    and the variables of every tab.
+    """
+    tab_vars: Dict[str, set] = {name: set(t.vars) for name, t in sheet.tabs.items()}
+    generated: List[Tuple[str, str, int]] = []
+    deps: Dict[str, set] = {} # tab -> tabs it is spawned or mapped from
+    periods = sheet.settings['periods']
+
+    def generate(name: str, source: str):
+        generated.append((name, source, periods))
+        tab_vars[name] = tab_vars.get(source, set())
+        deps.setdefault(name, set()).add(source)
+
+    for step in sheet.steps_tab.steps:
+        cmd = step[0].lower()
+        args = step[1:]
+        if cmd == 'set' and len(args) >= 2 and args[0].lower() == 'periods':
+            periods = int(args[1])
+        elif cmd == 'build' and len(args) >= 1:
+            name = args[0].strip().split(consts.FRIENDLY_NAME_DELIMITER)[0]
+            generate(name, name)
+        elif cmd == 'spawn' and len(args) >= 2:
+            for t in args[1].split(','):
+                generate(t.strip().split(consts.FRIENDLY_NAME_DELIMITER)[0], args[0])
+        elif cmd == 'matrix' and len(args) >= 2:
+            variants, assumption_names = matrix_variants(args)
+            for name, _, _ in variants:
+                generate(name, args[0])
+                deps[name].update(assumption_names)
+        elif cmd == 'map' and len(args) >= 3:
+            if len(args) == 3:
+                targets = [t.strip() for t in args[2].split(',')]
+            else:
+                targets = [args[2] if len(args) == 4 else args[3]]
+            for t in targets:
+                deps.setdefault(t, set()).add(args[0])
+
+    return generated, deps, tab_vars
+
+def dead_tabs(sheet: Sheet) -> List[str]:
+    """
+    Generated tabs that cannot affect any summarized variable, in the order they are generated.
+    A tab is live if it has a summarized variable, or if a live tab is spawned or mapped from it.
+    Only spawn/build/matrix/map steps are seen; references written directly into templates are not.
+    """
+    generated, deps, tab_vars = walk_steps(sheet)
+    names = [g[0] for g in generated]
+
+    summary_vars = set(sv[0] for sv in sheet.summary_vars)
+    live = set(name for name in names if len(tab_vars[name] & summary_vars) > 0)
+    pending = list(live)
+    while len(pending) > 0:
+        for source in deps.get(pending.pop(), set()):
+            if source not in live:
+                live.add(source)
+                pending.append(source)
+
+    dead: List[str] = []
+    for name in names:
+        if name not in live and name not in dead:
+            dead.append(name)
+    return dead
+
+def prune(sheet: Sheet, skip: bool = False):
+    """Reports the generated tabs that cannot reach the summary, and optionally leaves them out of the run."""
+    timer = Timer()
+    dead = dead_tabs(sheet)
+    if len(dead) == 0:
+        print(f'✔ All generated tabs reach the summary. {timer.check()}')
+        return
+    print(f'! {len(dead)} generated tab(s) cannot reach the summary: {", ".join(dead)} {timer.check()}')
+    if skip:
+        sheet.skip_tabs.update(dead)
+        print(f'  These will not be generated or written to.')
+    else:
+        print(f'  Run with --prune to skip them.')
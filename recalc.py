@@ -0,0 +1,182 @@
+from typing import List, Dict, Tuple, Iterator
+
+import re
+
+import gspread
+
+from utils import col_num_to_letter
+from timer import Timer
+import gapi
+import consts
+
+# Reads back the formulas of a finished book and reports what makes it slow to recalculate:
+# long dependency chains, formulas reading many cells, volatile functions, full-column ranges,
+# and SUBTOTALs over other SUBTOTALs.
+
+VOLATILE_FUNCTIONS = ['NOW', 'TODAY', 'RAND', 'RANDBETWEEN', 'RANDARRAY', 'OFFSET', 'INDIRECT']
+
+# 'Tab'!A1, Tab!A1:B2, $A$1, A:A, 3:3
+REF_PATTERN = re.compile(
+    r"(?:'((?:[^']|'')+)'!|(?<![\w.])([A-Za-z_][\w.\-]*)!)?"
+    r"(?<![\w.$])(\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?|\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|\$?\d+:\$?\d+)(?![\w(])"
+)
+STRING_PATTERN = re.compile(r'"(?:[^"]|"")*"')
+VOLATILE_PATTERN = re.compile(r'(?<![\w.])(' + '|'.join(VOLATILE_FUNCTIONS) + r')\s*\(', re.IGNORECASE)
+SUBTOTAL_PATTERN = re.compile(r'(?<![\w.])SUBTOTAL\s*\(', re.IGNORECASE)
+
+Cell = Tuple[str, int, int] # tab title, row, col
+Range = Tuple[str, int, int, int, int] # tab title, first row, first col, last row, last col
+
+def col_letter_to_num(letters: str) -> int:
+    num = 0
+    for c in letters:
+        num = num * 26 + ord(c) - 64
+    return num
+
+def parse_cell(ref: str) -> Tuple[int, int]:
+    m = re.match(r'^\$?([A-Z]+)\$?(\d+)$', ref)
+    return int(m.group(2)), col_letter_to_num(m.group(1))
+
+def formula_ranges(formula: str, tab: str, sizes: Dict[str, Tuple[int, int]]) -> Tuple[List[Range], int]:
+    """Ranges a formula reads from, and how many of them are full columns or rows."""
+    ranges: List[Range] = []
+    full = 0
+    for m in REF_PATTERN.finditer(STRING_PATTERN.sub('""', formula)):
+        title = m.group(1).replace("''", "'") if m.group(1) is not None else m.group(2) or tab
+        rows, cols = sizes.get(title, (0, 0))
+        ref = m.group(3).replace('$', '')
+        a, _, b = ref.partition(':')
+        if a.isdigit():
+            full += 1
+            ranges.append((title, int(a), 1, int(b), cols))
+        elif b != '' and b.isalpha():
+            full += 1
+            ranges.append((title, 1, col_letter_to_num(a), rows, col_letter_to_num(b)))
+        else:
+            r1, c1 = parse_cell(a)
+            r2, c2 = parse_cell(b) if b != '' else (r1, c1)
+            ranges.append((title, min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2)))
+    return ranges, full
+
+def read_formulas(spreadsheet: gspread.spreadsheet.Spreadsheet, titles: List[str], page_size: int = 20) -> Iterator[Tuple[str, List[List[any]]]]:
+    for start in range(0, len(titles), page_size):
+        page = titles[start:start + page_size]
+        values = gapi.read_ranges(spreadsheet, [f'\'{t}\'' for t in page], 'FORMULA').values()
+        yield from zip(page, values)
+
+def profile_book(spreadsheet: gspread.spreadsheet.Spreadsheet) -> Dict:
+    """
+    Formulas of every generated tab, with what each one reads from, and per tab:
+    cells, formulas, volatile calls, full-column/row ranges, SUBTOTALs and SUBTOTALs stacked on them.
+    """
+    worksheets = [s for s in spreadsheet.worksheets() if s.title[0] == consts.TAB_PREFIX_DYNAMIC]
+    sizes = {s.title: (s.row_count, s.col_count) for s in worksheets}
+
+    formulas: Dict[Cell, List[Range]] = {}
+    tabs: Dict[str, Dict] = {}
+    subtotals: Dict[Cell, List[Range]] = {}
+    for title, rows in read_formulas(spreadsheet, list(sizes)):
+        stats = {'cells': 0, 'formulas': 0, 'volatile': 0, 'full_ranges': 0, 'subtotals': 0, 'stacked_subtotals': 0, 'reads_from': {}}
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                if value == '':
+                    continue
+                stats['cells'] += 1
+                if not isinstance(value, str) or not value.startswith('='):
+                    continue
+                stats['formulas'] += 1
+                ranges, full = formula_ranges(value, title, sizes)
+                formulas[(title, r + 1, c + 1)] = ranges
+                stats['full_ranges'] += full
+                stats['volatile'] += len(VOLATILE_PATTERN.findall(value))
+                if SUBTOTAL_PATTERN.search(value):
+                    stats['subtotals'] += 1
+                    subtotals[(title, r + 1, c + 1)] = ranges
+                for rng in ranges:
+                    if rng[0] != title:
+                        stats['reads_from'][rng[0]] = stats['reads_from'].get(rng[0], 0) + 1
+        tabs[title] = stats
+
+    by_tab: Dict[str, List[Cell]] = {}
+    for cell in formulas:
+        by_tab.setdefault(cell[0], []).append(cell)
+
+    def formula_cells_in(rng: Range) -> List[Cell]:
+        title, r1, c1, r2, c2 = rng
+        if (r2 - r1 + 1) * (c2 - c1 + 1) <= len(by_tab.get(title, [])):
+            return [(title, r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1) if (title, r, c) in formulas]
+        return [cell for cell in by_tab.get(title, []) if r1 <= cell[1] <= r2 and c1 <= cell[2] <= c2]
+
+    # a SUBTOTAL skips other SUBTOTALs in its range, but still has to look at each of them
+    for cell, ranges in subtotals.items():
+        if any(other != cell and other in subtotals for rng in ranges for other in formula_cells_in(rng)):
+            tabs[cell[0]]['stacked_subtotals'] += 1
+
+    # length of the longest chain of formulas leading to each formula, without recursing
+    depth: Dict[Cell, int] = {}
+    precedents: Dict[Cell, List[Cell]] = {}
+    for root in formulas:
+        if root in depth:
+            continue
+        stack = [root]
+        visiting = set()
+        while len(stack) > 0:
+            cell = stack[-1]
+            if cell not in precedents:
+                precedents[cell] = [p for rng in formulas[cell] for p in formula_cells_in(rng) if p != cell]
+            pending = [p for p in precedents[cell] if p not in depth and p not in visiting]
+            if cell not in visiting and len(pending) > 0:
+                visiting.add(cell)
+                stack.extend(pending)
+                continue
+            stack.pop()
+            visiting.discard(cell)
+            # anything still being visited is a circular reference, and doesn't add to the depth
+            depth[cell] = 1 + max([depth[p] for p in precedents[cell] if p in depth], default=0)
+
+    fan_in = {
+        cell: sum((rng[3] - rng[1] + 1) * (rng[4] - rng[2] + 1) for rng in ranges)
+        for cell, ranges in formulas.items()
+    }
+    for title, stats in tabs.items():
+        cells = by_tab.get(title, [])
+        stats['max_depth'] = max([depth[c] for c in cells], default=0)
+        stats['fan_in'] = sum(fan_in[c] for c in cells)
+    return {'tabs': tabs, 'depth': depth, 'fan_in': fan_in}
+
+def cell_name(cell: Cell) -> str:
+    return f'\'{cell[0]}\'!{col_num_to_letter(cell[2])}{cell[1]}'
+
+def report(spreadsheet: gspread.spreadsheet.Spreadsheet, top: int = 10):
+    timer = Timer()
+    print(f'→ Reading formulas of the generated tabs...')
+    profile = profile_book(spreadsheet)
+    tabs = profile['tabs']
+    print(f'✔ {sum(t["formulas"] for t in tabs.values()):,} formula(s) in {len(tabs)} tab(s) profiled. {timer.check()}')
+
+    print(f'\n  {"Tab":<32}{"Cells":>10}{"Formulas":>10}{"Fan-in":>12}{"Depth":>7}{"Volatile":>10}{"Full col":>10}{"Subtotal":>10}{"Stacked":>9}')
+    for title, t in sorted(tabs.items(), key=lambda x: -x[1]['fan_in']):
+        print(f'  {title[:31]:<32}{t["cells"]:>10,}{t["formulas"]:>10,}{t["fan_in"]:>12,}{t["max_depth"]:>7}{t["volatile"]:>10}{t["full_ranges"]:>10}{t["subtotals"]:>10}{t["stacked_subtotals"]:>9}')
+
+    print(f'\n→ Tabs read from other tabs (references):')
+    for title, t in tabs.items():
+        if len(t['reads_from']) > 0:
+            sources = ', '.join(f'{s} ({n})' for s, n in sorted(t['reads_from'].items(), key=lambda x: -x[1]))
+            print(f'  {title} ← {sources}')
+
+    print(f'\n→ Longest dependency chains:')
+    for cell, d in sorted(profile['depth'].items(), key=lambda x: -x[1])[:top]:
+        print(f'  {cell_name(cell)}: {d} formula(s) deep')
+
+    print(f'\n→ Formulas reading the most cells:')
+    for cell, n in sorted(profile['fan_in'].items(), key=lambda x: -x[1])[:top]:
+        print(f'  {cell_name(cell)}: {n:,} cell(s)')
+
+    for key, message in [
+        ('volatile', 'volatile function call(s), recalculated on every change'),
+        ('full_ranges', 'full-column or full-row range(s)'),
+        ('stacked_subtotals', 'SUBTOTAL(s) over ranges holding other SUBTOTALs')
+    ]:
+        flagged = [f'{title} ({t[key]})' for title, t in tabs.items() if t[key] > 0]
+        if len(flagged) > 0:
+            print(f'! {sum(tabs[t][key] for t in tabs)} {message}: {", ".join(flagged)}')
@@ -0,0 +1,103 @@
+from typing import List, Dict
+
+import os
+import json
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from sheet import initialize_sheets, Sheet
+from commands import run_steps
+from utils import ensure
+from timer import Timer
+import accounts
+import gapi
+import consts
+
+# Scenarios share all the steps before the first `scenario` step. Those are run once in the base
+# book, which is then copied whole through Drive for each scenario, and only the scenario's own
+# steps (value overrides) are run in its copy. Copies are run in parallel, one process each, since
+# gapi queues requests globally. Processes are spawned rather than forked, so each starts clean and
+# builds its own services, instead of inheriting the base run's threads and open connections. Each
+# scenario starts on its own account of the pool, as workers count their calls separately, and
+# reports its calls back for the usage summary.
+
+DELTA_COMMANDS = ['map', 'trend', 'bump']
+
+def scenarios_path(spreadsheet_id: str) -> str:
+    return os.path.join(consts.JOURNAL_DIR, f'{spreadsheet_id}.scenarios.json')
+
+def check_deltas(sheet: Sheet, names: List[str]):
+    """Scenario steps may only change values; the summary of the copy is not rebuilt."""
+    for name in names:
+        ensure(name in sheet.steps_tab.scenarios, f'Scenario "{name}" not found in the steps.')
+        start, end = sheet.steps_tab.scenarios[name]
+        for step in sheet.steps_tab.steps[start:end]:
+            ensure(step[0].lower() in DELTA_COMMANDS, f'Scenario "{name}" has a {step[0].upper()} step; scenarios may only use {", ".join(c.upper() for c in DELTA_COMMANDS)}.')
+
+def run_scenario(spreadsheet_id: str, name: str, state: Dict, start: int, end: int, account: int) -> List[Dict]:
+    """
+    Runs in a worker process: picks up the copy where the base run finished, and runs the scenario's steps,
+    starting on the given account of the pool. Returns the calls made through each account.
+    """
+    accounts.use(accounts.pool[account])
+    accounts.reset_usage()
+    print(f'\n⇨ Scenario {name} as {accounts.current.email}...')
+    sheet = Sheet(spreadsheet_id, state=state)
+    sheet.steps_tab.cursor = start
+    sheet.steps_tab.end = end
+    run_steps(sheet, summarize=False)
+    return accounts.usage()
+
+def run_scenarios(sheet: Sheet, credentials: List[str], names: List[str] = None, workers: int = None) -> Dict[str, str]:
+    """
+    Runs the base steps in the book, then each scenario (all of them unless named) in its own copy.
+    Returns the ID of each scenario's copy.
+    """
+    timer = Timer()
+    scenarios = sheet.steps_tab.scenarios
+    ensure(len(scenarios) > 0, 'No scenario steps found.')
+    names = names or list(scenarios)
+    check_deltas(sheet, names)
+
+    print(f'\n⇨ Base...')
+    run_steps(sheet)
+    state = sheet.snapshot()
+
+    # copies from the previous run of a scenario are replaced
+    path = scenarios_path(sheet.ref.id)
+    copies: Dict[str, str] = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            copies = json.load(f)
+    for name in names:
+        if name in copies:
+            gapi.trash_file(copies.pop(name))
+        copies[name] = gapi.copy_spreadsheet(sheet.ref, f'{sheet.ref.title} [{name}]')
+        os.makedirs(consts.JOURNAL_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(copies, f)
+
+    failed: List[str] = []
+    with ProcessPoolExecutor(
+        max_workers=workers or len(names),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=initialize_sheets,
+        initargs=(credentials,)
+    ) as executor:
+        futures = [
+            executor.submit(run_scenario, copies[name], name, state, *scenarios[name], i % len(accounts.pool))
+            for i, name in enumerate(names)
+        ]
+        for name, future in zip(names, futures):
+            try:
+                accounts.add_usage(future.result())
+            except (Exception, SystemExit) as e:
+                # ensure() exits on failure; the other scenarios carry on
+                traceback.print_exception(e)
+                failed.append(name)
+
+    print(f'\n✔ {len(names) - len(failed)}/{len(names)} scenario(s) run. {timer.check()}')
+    for name in names:
+        print(f'  {"! " if name in failed else ""}{name}: https://docs.google.com/spreadsheets/d/{copies[name]}')
+    return {name: copies[name] for name in names if name not in failed}
@@ -0,0 +1,163 @@
+from typing import List, Dict, Tuple
+
+import os
+import json
+
+from sheet import Sheet
+from commands import run_steps
+from consolidate import consolidate
+from plan import walk_steps
+from utils import ensure
+from timer import Timer
+import gapi
+import consts
+
+def estimate_cells(sheet: Sheet) -> Tuple[int, Dict[str, int]]:
+    """
+    Cells of everything that isn't generated (inputs, steps, summary), and of each generated tab,
+    from the grid size of its template plus the columns added for its periods.
+    """
+    base = sum(t.ref.row_count * t.ref.col_count for t in sheet.tabs.values() if t.type != 'dynamic')
+    base += sheet.steps_tab.ref.row_count * sheet.steps_tab.ref.col_count
+    # periods run along the columns, or the rows for tabs that have them as rows
+    grids: Dict[str, Tuple[int, int, bool]] = {
+        name: (
+            t.ref.col_count if t.orientation == 'rows' else t.ref.row_count,
+            t.ref.row_count if t.orientation == 'rows' else t.ref.col_count,
+            t.get_pcol() is not None and not t.prebaked_periods
+        )
+        for name, t in sheet.tabs.items()
+    }
+    cells: Dict[str, int] = {}
+    generated, _, tab_vars = walk_steps(sheet)
+    for name, source, periods in generated:
+        rows, cols, expands = grids[source]
+        cols = cols + periods - 1 if expands else cols
+        grids[name] = (rows, cols, expands)
+        if name not in sheet.skip_tabs:
+            cells[name] = rows * cols
+
+    # the summary gains a row per tab for each summarized variable it has
+    summary_vars = set(sv[0] for sv in sheet.summary_vars)
+    summary_rows = sum(len(tab_vars[name] & summary_vars) for name in cells)
+    base += summary_rows * (sheet.summary_tab.ref.col_count + sheet.settings['periods'])
+    return base, cells
+
+def plan_shards(sheet: Sheet, max_cells: int) -> List[List[str]]:
+    """
+    Splits the generated tabs into groups that each fit in a spreadsheet of max_cells, or returns a
+    single group if everything fits in one. Tabs that map or spawn from each other stay together;
+    tabs without summarized variables that others only read from (e.g. built assumptions) are
+    repeated in every shard that needs them, so they don't tie everything into one shard.
+    """
+    timer = Timer()
+    base, cells = estimate_cells(sheet)
+    total = base + sum(cells.values())
+    print(f'→ Estimated size: {total:,} cell(s), {len(cells)} generated tab(s). {timer.check()}')
+    if total <= max_cells:
+        return [list(cells)]
+
+    _, deps, tab_vars = walk_steps(sheet)
+    summary_vars = set(sv[0] for sv in sheet.summary_vars)
+    deps = {name: set(d for d in deps.get(name, set()) if d in cells and d != name) for name in cells}
+
+    def closure(name: str) -> set:
+        found = set()
+        pending = [name]
+        while len(pending) > 0:
+            for d in deps[pending.pop()]:
+                if d not in found:
+                    found.add(d)
+                    pending.append(d)
+        return found
+
+    shared = set(
+        name for name in cells
+        if len(tab_vars[name] & summary_vars) == 0 and all(len(tab_vars[d] & summary_vars) == 0 for d in closure(name))
+    )
+
+    # tabs tied together by spawn/map edges, either way round, not counting the shared ones
+    parent: Dict[str, str] = {name: name for name in cells if name not in shared}
+    def root(name: str) -> str:
+        while parent[name] != name:
+            name = parent[name]
+        return name
+    for name in parent:
+        for d in deps[name]:
+            if d in parent:
+                parent[root(d)] = root(name)
+    components: Dict[str, List[str]] = {}
+    for name in parent:
+        components.setdefault(root(name), []).append(name)
+
+    def needs(tabs: List[str]) -> set:
+        return set(d for name in tabs for d in closure(name) if d in shared)
+
+    # first fit, biggest first
+    capacity = max_cells - base
+    shards: List[List[str]] = []
+    for c in sorted(components.values(), key=lambda c: -sum(cells[n] for n in c)):
+        for shard in shards:
+            tabs = shard + c
+            if sum(cells[n] for n in tabs) + sum(cells[n] for n in needs(tabs)) <= capacity:
+                shard.extend(c)
+                break
+        else:
+            if sum(cells[n] for n in c) > capacity:
+                print(f'! {", ".join(c)} are linked and need more than {max_cells:,} cells on their own.')
+            shards.append(list(c))
+
+    order = list(cells)
+    shards = [sorted(shard + list(needs(shard)), key=order.index) for shard in shards]
+    for i, shard in enumerate(shards):
+        print(f'  Shard {i + 1}: {len(shard)} tab(s), ~{base + sum(cells[n] for n in shard):,} cell(s).')
+    return shards
+
+def shards_path(spreadsheet_id: str) -> str:
+    return os.path.join(consts.JOURNAL_DIR, f'{spreadsheet_id}.shards.json')
+
+def run_sharded(sheet: Sheet, shards: List[List[str]]):
+    """
+    Runs each shard's tabs in a fresh copy of the book, then consolidates the shard summaries
+    into the main book, which generates none of the tabs itself.
+    """
+    timer = Timer()
+    generated = set(name for shard in shards for name in shard)
+
+    # shards from the previous run are replaced
+    path = shards_path(sheet.ref.id)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for shard_id in json.load(f):
+                gapi.trash_file(shard_id)
+
+    # requests queued while opening the main book (the summary's column and colour) belong to it;
+    # left queued, the first shard's Sheet would send them to its copy, which has the same tab ids
+    sheet.flush()
+
+    shard_ids: List[str] = []
+    for i, shard in enumerate(shards):
+        print(f'\n⇨ Shard {i + 1}/{len(shards)}...')
+        shard_id = gapi.copy_spreadsheet(sheet.ref, f'{sheet.ref.title} [shard {i + 1}]')
+        shard_ids.append(shard_id)
+        os.makedirs(consts.JOURNAL_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(shard_ids, f)
+        shard_sheet = Sheet(shard_id)
+        shard_sheet.skip_tabs = sheet.skip_tabs | (generated - set(shard))
+        run_steps(shard_sheet)
+
+    print(f'\n⇨ Main book...')
+    sheet.skip_tabs = sheet.skip_tabs | generated
+    run_steps(sheet)
+    consolidate(sheet.ref.id, shard_ids)
+    print(f'✔ {len(shards)} shard(s) run and consolidated. {timer.check()}')
+
+def run_steps_sharded(sheet: Sheet, max_cells: int):
+    shards = plan_shards(sheet, max_cells)
+    if len(shards) <= 1:
+        run_steps(sheet)
+    else:
+        ensure(sheet.steps_tab.cursor == 0, 'A resumed run cannot be sharded.')
+        ensure(sheet.settings['summary-mode'] == 'wide', 'Shards are consolidated by their summaries, which need to be in wide format.')
+        run_sharded(sheet, shards)
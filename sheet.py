@@ -1,62 +1,118 @@
 from typing import List, Dict, Tuple
 
 import re
+import copy
+import time
+import json
+import hashlib
+import random
 import asyncio
 from functools import partial
 
 import gspread
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 
 from utils import col_num_to_letter, ensure, parallel_calls, row_col_to_cell_ref
 from timer import Timer
+from journal import Journal, steps_hash
+from history import RunHistory
+import accounts
 import gapi
 import consts
 
-# Define the scope
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-    "https://www.googleapis.com/auth/spreadsheets"
-]
+spreadsheets: Dict[Tuple[str, str], gspread.spreadsheet.Spreadsheet] = {}
 
-def initialize_sheets(creds_file):
-    global creds, client
-    # Add credentials to the account
-    creds = Credentials.from_service_account_file(creds_file, scopes=scope)
-    client = gspread.authorize(creds)
+def initialize_sheets(creds_files: str | List[str]):
+    """Loads one service account, or a pool of them (files, or directories of .json files)."""
+    accounts.load(creds_files if isinstance(creds_files, list) else [creds_files])
+    spreadsheets.clear()
 
-    # for raw API calls
-    gapi.set_service(build('sheets', 'v4', credentials=creds))
+def open_spreadsheet(sheetKey: str) -> gspread.spreadsheet.Spreadsheet:
+    """Cached, so a long-lived process only opens each spreadsheet once."""
+    key = (accounts.current.email, sheetKey)
+    if key not in spreadsheets:
+        spreadsheets[key] = accounts.current.client.open_by_key(sheetKey)
+    return spreadsheets[key]
+
+# tabs of a spreadsheet fetched ahead of its next run, e.g. by the daemon between runs: (when, tabs)
+prefetched_worksheets: Dict[str, Tuple[float, List[gspread.worksheet.Worksheet]]] = {}
+
+def prefetch_worksheets(sheetKey: str):
+    prefetched_worksheets[sheetKey] = (time.time(), open_spreadsheet(sheetKey).worksheets())
+
+def take_worksheets(spreadsheet: gspread.spreadsheet.Spreadsheet) -> List[gspread.worksheet.Worksheet]:
+    """The prefetched tabs if still fresh, else fetched now. Prefetched tabs are only used once, as a run changes them."""
+    fetched = prefetched_worksheets.pop(spreadsheet.id, None)
+    if fetched is not None and time.time() - fetched[0] <= consts.PREFETCH_MAX_AGE:
+        return fetched[1]
+    return spreadsheet.worksheets()
+
+def unused_sheet_id(taken: set) -> int:
+    sheet_id = random.randint(1, 2**31 - 1)
+    while sheet_id in taken:
+        sheet_id = random.randint(1, 2**31 - 1)
+    return sheet_id
+
+def local_worksheet(spreadsheet: gspread.spreadsheet.Spreadsheet, properties: Dict) -> gspread.worksheet.Worksheet:
+    """Worksheet for a tab whose creation is still queued, built from the properties it will have."""
+    return gspread.worksheet.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client)
 
 class Sheet:
-    def __init__(self, sheetKey: str):
+    def __init__(self, sheetKey: str, resume: bool = False, state: Dict = None):
+        """With state, the book is a copy of a finished run, picked up in the state that run finished in."""
         timer = Timer()
         print('⇨ Connecting to Sheet...', end='')
-        self.ref = client.open_by_key(sheetKey)
+        self.ref = open_spreadsheet(sheetKey)
         print(f'connected. {timer.check()}')
         self.tabs: Dict[str, Tab] = {}
         self.steps_tab: StepsTab = None
         self.summary_tab: SummaryTab = None
         timer = Timer()
-        all_sheets = self.ref.worksheets()
+        all_sheets = take_worksheets(self.ref)
         print(f'  Sheets loaded. {timer.check()}')
         self.raw_tab_count = len(all_sheets)
+        self.sheet_ids = set(s.id for s in all_sheets)
 
         self.settings = {
             'periods': 12,
             'summary-periods': 12,
-            'summary-start': 1
+            'summary-start': 1,
+            'template-cache': 'run',
+            'summary-mode': 'wide'
         }
         self.summary_vars: List[Tuple[str, str]] = []
         self.summary_tab_order: List[Tab] = []
         self.tab_groups: List[str] = []
+        self.skip_tabs: set = set()
+        self.expanded: Dict[str, Tab] = {} # title of expanded template -> its tab
+        self.kept_expansions: Dict[str, gspread.worksheet.Worksheet] = {}
+
+        self.journal = Journal(sheetKey)
+        self.history = RunHistory(sheetKey)
+        resume_point = self.journal.resume_point() if resume else None
+        if resume and resume_point is None:
+            print('! Nothing to resume, performing a full run.')
+        if state is not None:
+            resume_point = {'steps_hash': None, 'cursor': state['cursor'], 'state': state}
+        # dynamic tabs already committed by the interrupted run are kept, anything newer is swept
+        kept = [] if resume_point is None else [t for t in resume_point['state']['tabs'] if t['type'] != 'input']
+        kept_ids = [t['id'] for t in kept]
+        kept_titles = [t['title'] for t in kept]
 
         # sweep first to remove all transient tabs, to avoid triggering duplicate tab error on summary spawn
         # also, pull values from all input and summary tabs
         ranges_to_read: List[str] = []
         for sheet in all_sheets:
-            if sheet.title[0] == consts.TAB_PREFIX_DYNAMIC:
+            if sheet.title[0] == consts.TAB_PREFIX_DYNAMIC and (sheet.id in kept_ids or sheet.title in kept_titles):
+                continue
+            elif sheet.title[0] == consts.TAB_PREFIX_EXPANDED and consts.EXPANDED_FINGERPRINT_DELIMITER in sheet.title:
+                # finished expansion kept from an earlier run, reused if its template hasn't changed
+                self.kept_expansions[sheet.title] = sheet
+            elif sheet.title[0] == consts.TAB_PREFIX_EXPANDED:
+                # expansion only meant for the run that made it
+                gapi.delete_tab(sheet)
+                self.raw_tab_count -= 1
+                print(f'→ Tab "{sheet.title}" removed.')
+            elif sheet.title[0] == consts.TAB_PREFIX_DYNAMIC:
                 # generated tab, for cleanup
                 gapi.delete_tab(sheet)
                 # self.ref.del_worksheet(t)
@@ -64,7 +120,7 @@ class Sheet:
                 print(f'→ Tab "{sheet.title}" removed.')
             elif sheet.title == consts.TAB_TITLE_STEPS:
                 ranges_to_read.append(sheet.title)
-            elif sheet.title[0] == consts.TAB_PREFIX_INPUT:
+            elif sheet.title[0] == consts.TAB_PREFIX_INPUT and resume_point is None:
                 # steps, summary, or input
                 ranges_to_read.append(f'\'{sheet.title}\'!A1:1')
                 ranges_to_read.append(f'\'{sheet.title}\'!A1:A')
@@ -100,6 +156,8 @@ class Sheet:
             if sheet.title == consts.TAB_TITLE_STEPS:
                 print('✔ Capturing Steps tab...')
                 self.steps_tab = StepsTab(sheet, full_cache)
+            elif resume_point is not None:
+                continue
             elif sheet.title == consts.TAB_TITLE_SUMMARY:
                 print('✔ Capturing Summary tab...')
                 self.summary_tab = self.register_summary_tab(
@@ -115,8 +173,156 @@ class Sheet:
 
         if self.steps_tab == None:
             raise(Exception('No Steps tab found!'))
+
+        if state is not None:
+            self.restore(state, all_sheets)
+            self.journal.start(steps_hash(self.steps_tab.steps))
+        elif resume_point is not None:
+            ensure(resume_point['steps_hash'] == steps_hash(self.steps_tab.steps), 'Steps have changed since the interrupted run, cannot resume. Run again without resuming.')
+            self.restore(resume_point['state'], all_sheets)
+            self.journal.resume(self.steps_tab.cursor)
+            print(f'✔ Resuming after step {self.steps_tab.cursor}/{len(self.steps_tab.steps)}.')
+        else:
+            self.journal.start(steps_hash(self.steps_tab.steps))
+
         if self.summary_tab == None:
             raise(Exception('No Summary tab found!'))
+
+    def snapshot(self) -> Dict:
+        """Everything needed to pick the run back up at the current steps cursor."""
+        return {
+            'cursor': self.steps_tab.cursor,
+            'raw_tab_count': self.raw_tab_count,
+            'settings': dict(self.settings),
+            'summary_vars': [list(sv) for sv in self.summary_vars],
+            'summary_tab_order': [t.name for t in self.summary_tab_order],
+            'tab_groups': list(self.tab_groups),
+            'skip_tabs': sorted(self.skip_tabs),
+            'tabs': [t.snapshot() for t in self.tabs.values()]
+        }
+
+    def restore(self, state: Dict, all_sheets: List[gspread.worksheet.Worksheet]):
+        worksheets = {s.id: s for s in all_sheets}
+        titles = {s.title: s for s in all_sheets}
+        self.raw_tab_count = state['raw_tab_count']
+        self.settings = state['settings']
+        self.summary_vars = [tuple(sv) for sv in state['summary_vars']]
+        self.tab_groups = state['tab_groups']
+        self.skip_tabs = set(state['skip_tabs'])
+        for t in state['tabs']:
+            # tabs are matched by title where the ID has changed, e.g. in a copy of the book
+            worksheet = worksheets.get(t['id']) or titles.get(t['title'])
+            ensure(worksheet is not None, f'Tab "{t["title"]}" from the earlier run no longer exists, cannot pick it up.')
+            tab = Tab(worksheet, self, state=t)
+            self.tabs[tab.name] = tab
+            if tab.type == 'summary':
+                self.summary_tab = SummaryTab(tab, restore=True)
+        self.summary_tab_order = [self.tabs[name] for name in state['summary_tab_order']]
+        self.steps_tab.cursor = state['cursor']
+
+    def new_sheet_id(self) -> int:
+        sheet_id = unused_sheet_id(self.sheet_ids)
+        self.sheet_ids.add(sheet_id)
+        return sheet_id
+
+    def duplicate_worksheet(self, source: gspread.worksheet.Worksheet, title: str) -> gspread.worksheet.Worksheet:
+        """
+        Queues a duplicate of the source with a preassigned sheet ID, so the new tab can be registered
+        and written to in the same batch that creates it, without waiting on a flush.
+        """
+        sheet_id = self.new_sheet_id()
+        self.raw_tab_count += 1
+        gapi.duplicate_tab(source, title, self.raw_tab_count, new_sheet_id=sheet_id)
+        properties = copy.deepcopy(source._properties)
+        properties.update({
+            'sheetId': sheet_id,
+            'title': title,
+            'index': self.raw_tab_count
+        })
+        return local_worksheet(self.ref, properties)
+
+    def spawn_tab(self, template: 'Tab', title: str) -> 'Tab':
+        """
+        Duplicates a template into a new dynamic tab with its periods expanded. Where the template
+        can be, it is expanded once into a hidden tab, and that is duplicated instead.
+        """
+        expanded = self.expanded_template(template)
+        if expanded is None:
+            new_tab = template.register_duplicate(self.duplicate_worksheet(template.ref, title))
+        else:
+            new_sheet = self.duplicate_worksheet(expanded.ref, title)
+            gapi.update_tab_properties(new_sheet, {'hidden': False, 'tabColor': { 'red': 1, 'green': 0, 'blue': 0 }})
+            new_tab = self.register_tab(new_sheet, copyAttributesFrom=expanded)
+        return new_tab
+
+    def expanded_template(self, template: 'Tab') -> 'Tab':
+        """
+        Hidden copy of an input template with its periods expanded for the current periods setting,
+        made the first time it's needed. With template-cache set to keep, it stays in the book under a
+        fingerprint of the template, for later runs to reuse until the template changes.
+        """
+        mode = self.settings['template-cache']
+        if mode == 'off' or template.type != 'input' or template.get_pcol() is None or template.prebaked_periods:
+            return None
+        title = f'{consts.TAB_PREFIX_EXPANDED}{template.name}@{self.settings["periods"]}'
+        if mode == 'keep':
+            title = f'{title}{consts.EXPANDED_FINGERPRINT_DELIMITER}{template_fingerprint(template)}'
+        if title in self.expanded:
+            return self.expanded[title]
+
+        # kept expansions of an older version of the template, or for another periods setting, are stale
+        stale = re.compile(f'^{re.escape(consts.TAB_PREFIX_EXPANDED + template.name)}@\\d+{re.escape(consts.EXPANDED_FINGERPRINT_DELIMITER)}')
+        for kept_title in [t for t in self.kept_expansions if stale.match(t) and t != title]:
+            gapi.delete_tab(self.kept_expansions.pop(kept_title))
+            self.raw_tab_count -= 1
+            print(f'→ Stale tab "{kept_title}" removed.')
+
+        if title in self.kept_expansions:
+            expanded = Tab(self.kept_expansions[title], self, copy_attributes_from=template)
+            expanded.detach_attributes()
+            expanded.shift_for_periods()
+        else:
+            # only titled as finished once fully expanded, in case the run dies partway
+            unfinished = title.split(consts.EXPANDED_FINGERPRINT_DELIMITER)[0]
+            expanded = Tab(self.duplicate_worksheet(template.ref, unfinished), self, copy_attributes_from=template)
+            expanded.detach_attributes()
+            gapi.update_tab_properties(expanded.ref, {'hidden': True})
+            expanded.expand_periods()
+            if title != unfinished:
+                gapi.update_tab_properties(expanded.ref, {'title': title})
+                expanded.ref._properties['title'] = title
+        self.expanded[title] = expanded
+        return expanded
+
+    def probe_tab(self, base: 'Tab', title: str) -> 'Tab':
+        """Hidden copy of a tab to try other inputs in, kept out of the summary, and dropped once read."""
+        probe = Tab(self.duplicate_worksheet(base.ref, f'{consts.TAB_PREFIX_DYNAMIC}{title}'), self, copy_attributes_from=base)
+        gapi.update_tab_properties(probe.ref, {'hidden': True})
+        return probe
+
+    def drop_tabs(self, tabs: List['Tab']):
+        for t in tabs:
+            gapi.delete_tab(t.ref)
+            self.raw_tab_count -= 1
+
+    def add_values_tab(self, title: str, block: List[List[any]]):
+        """New tab holding a block of values, e.g. a report, queued with the next batch."""
+        sheet_id = self.new_sheet_id()
+        self.raw_tab_count += 1
+        gapi.add_tab(sheet_id, title, len(block), max(len(row) for row in block), self.raw_tab_count)
+        tab = local_worksheet(self.ref, {
+            'sheetId': sheet_id,
+            'title': title,
+            'gridProperties': {'rowCount': len(block), 'columnCount': max(len(row) for row in block)}
+        })
+        gapi.update_cells(tab, 1, 1, block)
+
+    def checkpoint(self):
+        self.journal.checkpoint(self.steps_tab.cursor, self.snapshot())
+
+    def record_history(self, ok: bool):
+        generated = [t for t in self.tabs.values() if t.type == 'dynamic']
+        self.history.finish(len(generated), sum(len(t.vars) for t in generated), self.settings['periods'], ok)
         
     def register_summary_tab(self, sheet: gspread.worksheet.Worksheet, copyAttributesFrom: 'Tab' = None, cached_row_headers = [], cached_col_headers = []) -> 'SummaryTab':
         newTab = SummaryTab(
@@ -144,7 +350,16 @@ class Sheet:
         return self.tabs[tab_name]
 
     def flush(self):
-        gapi.flush_requests(self.ref)
+        # steps that need replies midway (sensitivity, seek) flush before they end; their batches carry
+        # the checkpoint from the start of the step, so a resumed run repeats the step, and the probe
+        # tabs it had made are swept since the checkpoint doesn't have them
+        if gapi.pipeline is not None:
+            # batches are recorded as they land
+            gapi.drain_requests()
+            return
+        response = gapi.flush_requests(self.ref)
+        if response is not None:
+            self.journal.record_batch(response, self.journal.pending)
 
     def add_summary_var(self, var, method):
         self.summary_vars.append((var, method))
@@ -157,6 +372,29 @@ class Sheet:
 
         self.summary_tab.summarize()
 
+    def result_tabs(self) -> List['Tab']:
+        """Every generated tab with periods, and the summary unless it's in long format."""
+        return [
+            t for t in self.tabs.values()
+            if (t.type == 'dynamic' or t.type == 'summary' and self.settings['summary-mode'] == 'wide') and t.get_pcol() is not None
+        ]
+
+    def publish(self):
+        """
+        Queues the layout of each tab as one developer metadata entry on it, so other tools can find
+        any variable in one call rather than from the headers. Called once the summary is built, when
+        every row is where it will stay. The entries are left out if they would go over the API's cap
+        on metadata per spreadsheet, which would fail the batch.
+        """
+        tabs = self.result_tabs()
+        values = [json.dumps(t.layout(), separators=(',', ':')) for t in tabs]
+        size = sum(len(consts.METADATA_LAYOUT) + len(v) for v in values)
+        if size > consts.METADATA_MAX_CHARS:
+            print(f'! The layout of {len(tabs)} tab(s) would take {size:,} characters of metadata, over the {consts.METADATA_MAX_CHARS:,} allowed; not published.')
+            return
+        for t, value in zip(tabs, values):
+            gapi.create_metadata(t.ref, consts.METADATA_LAYOUT, value)
+
     def add_tab_group(self, label: str, subtabs: List[str]):
         if label in self.tab_groups:
             raise(Exception(f'Tab group {label} already defined!'))
@@ -169,7 +407,7 @@ class Sheet:
             self.summary_tab_order.append(tab)
 
 class Tab:
-    def __init__(self, worksheet: gspread.worksheet.Worksheet, sheet: Sheet, copy_attributes_from: 'Tab' = None, cached_row_headers = [], cached_col_headers = []):
+    def __init__(self, worksheet: gspread.worksheet.Worksheet, sheet: Sheet, copy_attributes_from: 'Tab' = None, cached_row_headers = [], cached_col_headers = [], state: Dict = None):
         timer = Timer()
         self.ref = worksheet
         self.sheet = sheet
@@ -179,12 +417,31 @@ class Tab:
         self.prebaked_periods = False
         self.group = None
         self.type = 'input' if worksheet.title[0] == consts.TAB_PREFIX_INPUT else 'dynamic'
+        # 'columns' has periods across and variables down, 'rows' the other way round;
+        # vars and cols are kept the same way for both, and only turned around when reading or writing cells
+        self.orientation = 'columns'
 
         self.vars: Dict[str, Tuple[int, int]] = {} # label -> row, count
         self.cols: Dict[str, int] = {} # label -> col
 
-        if copy_attributes_from == None:
+        if state is not None:
+            # restored from the journal of an interrupted run, or the end of the run a copy was made from
+            self.type = state['type']
+            self.friendly_name = state['friendly_name']
+            self.group = state['group']
+            self.prebaked_periods = state['prebaked_periods']
+            self.orientation = state.get('orientation', 'columns')
+            self.vars = state['vars']
+            self.cols = state['cols']
+            self.pcol = state['pcol']
+            self.gcol = state['gcol']
+        elif copy_attributes_from == None:
             col_vars = cached_col_headers[self.name] if self.name in cached_col_headers else self.ref.col_values(1)
+            row_vals = cached_row_headers[self.name] if self.name in cached_row_headers else self.ref.row_values(1)
+            if not any(str(v) in ['p', 'p1'] for v in row_vals) and any(str(v) in ['p', 'p1'] for v in col_vars):
+                # p row marker: periods run down, and variables across the header row
+                self.orientation = 'rows'
+                col_vars, row_vals = row_vals, col_vars
             # cache var references
             temp = {str(value): row + 1 for row, value in enumerate(col_vars) if value}
             for t in temp:
@@ -194,20 +451,35 @@ class Tab:
                 else:
                     self.vars[t] = [temp[t], 1]
             # find p column
-            row_vals = cached_row_headers[self.name] if self.name in cached_row_headers else self.ref.row_values(1)
             self.cols = {str(value): col + 1 for col, value in enumerate(row_vals) if value}
             self.pcol = self.get_pcol()
             self.gcol = self.get_gcol()
         else:
             self.prebaked_periods = copy_attributes_from.prebaked_periods
+            self.orientation = copy_attributes_from.orientation
             self.vars = copy_attributes_from.vars
             self.cols = copy_attributes_from.cols
             self.pcol = copy_attributes_from.pcol
             self.gcol = copy_attributes_from.gcol
-        print(f'✔ Tab {self.ref.title} registered. {len(self.vars)} variable(s). Period column {"not " if self.pcol is None else ""}found. {timer.check()}')
+        print(f'✔ Tab {self.ref.title} registered. {len(self.vars)} variable(s). Period {"row" if self.orientation == "rows" else "column"} {"not " if self.pcol is None else ""}found. {timer.check()}')
         if self.prebaked_periods == True:
             print(f'  Prebaked period columns found at {self.pcol}')
 
+    def snapshot(self) -> Dict:
+        return {
+            'id': self.id,
+            'title': self.ref.title,
+            'type': self.type,
+            'friendly_name': self.friendly_name,
+            'group': self.group,
+            'prebaked_periods': self.prebaked_periods,
+            'orientation': self.orientation,
+            'vars': {k: list(v) for k, v in self.vars.items()},
+            'cols': dict(self.cols),
+            'pcol': self.pcol,
+            'gcol': self.gcol
+        }
+
     def get_pcol(self) -> int:
         output = None if 'p' not in self.cols else self.cols['p']
         if 'p1' in self.cols:
@@ -246,17 +518,35 @@ class Tab:
         self.nudge_col('g', delta)
         self.gcol = self.get_col('g')
 
+    def cell(self, row: int, col: int) -> Tuple[int, int]:
+        """Sheet row and column of a variable row and label column, turned around for periods as rows."""
+        return (col, row) if self.orientation == 'rows' else (row, col)
+    def cell_ref(self, row: int, col: int, absolute: bool = False) -> str:
+        r, c = self.cell(row, col)
+        return f'${col_num_to_letter(c)}${r}' if absolute else row_col_to_cell_ref(r, c)
+    def period_range_ref(self, row: int) -> str:
+        """Absolute reference to all the periods of a variable row, including the tab title."""
+        start = self.cell_ref(row, self.get_pcol(), absolute=True)
+        end = self.cell_ref(row, self.get_pcol() + self.sheet.settings['periods'] - 1, absolute=True)
+        return f'\'{self.ref.title}\'!{start}:{end}'
+
+    def range_ref(self, var: Tuple[int, int], start_col: int, end_col: int) -> str:
+        """Absolute reference to the rows of a variable between two label columns, including the tab title."""
+        start = self.cell_ref(var[0], start_col, absolute=True)
+        end = self.cell_ref(var[0] + var[1] - 1, end_col, absolute=True)
+        return f'\'{self.ref.title}\'!{start}:{end}'
+
     def get_row_col_ref(self, row, col, idx = 0) -> str:
-        return f'\'{self.ref.title}\'!{col_num_to_letter(col)}{row + idx}'
+        return f'\'{self.ref.title}\'!{self.cell_ref(row + idx, col)}'
     def get_var_col_refs(self, var: Tuple[int, int], col: str) -> List[str] | List[List[str]]:
         """May return a vertical stack if variable is multi-row"""
         baseRow = var[0]
         count = var[1]
         baseCol = self.get_col(col)
         if col == 'p':
-            result = [[f'{col_num_to_letter(baseCol + x)}{baseRow + y}' for x in range(0, self.sheet.settings['periods'])] for y in range(0, count)]
+            result = [[self.cell_ref(baseRow + y, baseCol + x) for x in range(0, self.sheet.settings['periods'])] for y in range(0, count)]
         else:
-            result = [f'{col_num_to_letter(baseCol)}{baseRow + y}' for y in range(0, count)]
+            result = [self.cell_ref(baseRow + y, baseCol) for y in range(0, count)]
         return result
     
     def duplicate(self, newTitle: str = '', clone: bool = False, expand_periods: bool = False) -> 'Tab':
@@ -281,6 +571,11 @@ class Tab:
             new_tab.expand_periods()
         return new_tab
     
+    def detach_attributes(self):
+        """Own copies of the vars and cols shared with the tab these were copied from."""
+        self.vars = copy.deepcopy(self.vars)
+        self.cols = dict(self.cols)
+
     def register_duplicate(self, new_sheet):
         gapi.update_tab_color(new_sheet, { 'red': 1, 'green': 0, 'blue': 0 })
         newTab = self.sheet.register_tab(new_sheet, copyAttributesFrom=self)
@@ -296,27 +591,87 @@ class Tab:
     
     def update_period_cells(self, row: int, vals: List[str | List[str]]):
         """If vals is a List of Lists then it's rows x cols, otherwise a single row."""
-        startRow = row
-        startCol = self.get_pcol()
-        gapi.update_cells(self.ref, startRow, startCol, vals if isinstance(vals[0],List) else [vals])
+        self.update_block(row, self.get_pcol(), vals if isinstance(vals[0],List) else [vals])
+
+    def fill_period_cells(self, row: int, seeds: List[str]):
+        """Writes a seed column into the first period, and has the server fill it across the remaining periods."""
+        self.update_cell(row, self.get_pcol(), seeds)
+        if self.orientation == 'rows':
+            gapi.fill_down(self.ref, self.get_pcol(), row, len(seeds), self.sheet.settings['periods'] - 1)
+        else:
+            gapi.fill_right(self.ref, row, self.get_pcol(), len(seeds), self.sheet.settings['periods'] - 1)
 
     def update_cell(self, row: int, col: int, vals: str | List[str]):
         """Can accept a vertical stack, by passing List[str] to val."""
-        gapi.update_cells(self.ref, row, col, [[c] for c in vals] if isinstance(vals, List) else [[vals]])
+        self.update_block(row, col, [[c] for c in vals] if isinstance(vals, List) else [[vals]])
+
+    def update_block(self, row: int, col: int, vals: List[List[any]]):
+        """vals is variable rows by label columns, written turned around for periods as rows."""
+        r, c = self.cell(row, col)
+        gapi.update_cells(self.ref, r, c, [list(x) for x in zip(*vals)] if self.orientation == 'rows' else vals)
+
+    def repeat_value(self, row: int, col: int, rows: int, cols: int, value):
+        r, c = self.cell(row, col)
+        if self.orientation == 'rows':
+            rows, cols = cols, rows
+        gapi.repeat_value(self.ref, r, c, rows, cols, value)
     
     def expand_periods(self):
         if self.get_pcol() is None:
             return
-        # duplicate p column as needed
-        gapi.duplicate_column(self.ref, self.get_pcol(), self.sheet.settings['periods'] - 1)
+        # duplicate p column (or row) as needed
+        if self.orientation == 'rows':
+            gapi.duplicate_row(self.ref, self.get_pcol(), self.sheet.settings['periods'] - 1)
+        else:
+            gapi.duplicate_column(self.ref, self.get_pcol(), self.sheet.settings['periods'] - 1)
         cells: List[str] = [''] * self.sheet.settings['periods']
         for i in range(len(cells)):
             cells[i] = f'P{i+1}'
         self.update_period_cells(1, cells)
+        self.shift_for_periods()
+
+    def layout(self) -> Dict:
+        """Where the tab's results are: its variables' rows and its period columns (turned around for periods as rows)."""
+        return {
+            'name': self.name,
+            'title': self.ref.title,
+            'type': self.type,
+            'orientation': self.orientation,
+            'vars': self.vars,
+            'pcol': self.get_pcol(),
+            'periods': self.sheet.settings['periods']
+        }
+
+    def shift_for_periods(self):
+        """Moves the columns right of the period column past the expanded periods."""
         if self.get_gcol() is not None and self.get_gcol() > self.get_pcol():
             self.nudge_gcol(self.sheet.settings['periods'] - 1)
         #self.ref.update_cells(cells)
 
+def template_fingerprint(template: Tab) -> str:
+    """Short hash of a template's grid size and formulas, to tell whether a kept expansion of it is stale."""
+    formulas = template.ref.get_values(value_render_option=gspread.utils.ValueRenderOption.formula)
+    content = json.dumps([template.ref.row_count, template.ref.col_count, formulas])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:10]
+
+def clean_steps(rows: List[List[str]]) -> List[List[str]]:
+    """Drops blank rows, and blank cells trailing each step."""
+    steps = [step for step in rows if any(token != "" for token in step)]
+    for step in steps:
+        while step[-1] == "":
+            step.pop()
+    return steps
+
+def scenario_sections(steps: List[List[str]]) -> Dict[str, Tuple[int, int]]:
+    """Steps of each scenario, as a range of cursor positions, from its scenario step to the next one."""
+    starts = [(i, step[1] if len(step) > 1 else '') for i, step in enumerate(steps) if step[0].lower() == 'scenario']
+    sections: Dict[str, Tuple[int, int]] = {}
+    for n, (i, name) in enumerate(starts):
+        ensure(name != '', f'Scenario step {i + 1} has no name.')
+        ensure(name not in sections, f'Scenario "{name}" defined twice.')
+        sections[name] = (i + 1, starts[n + 1][0] if n + 1 < len(starts) else len(steps))
+    return sections
+
 class StepsTab:
     def __init__(self, worksheet: gspread.worksheet.Worksheet, cached_cells = None):
         timer = Timer()
@@ -325,15 +680,17 @@ class StepsTab:
             self.steps = cached_cells['steps']
         else:
             self.steps = self.ref.get_all_values()
-        self.steps = [step for step in self.steps if any(token != "" for token in step)]
-        for step in self.steps:
-            while step[-1] == "":
-                step.pop()
+        self.steps = clean_steps(self.steps)
         self.cursor = 0
+        # steps after the first scenario step are deltas, only run in copies of the finished book
+        self.scenarios = scenario_sections(self.steps)
+        self.end = min([start - 1 for start, _ in self.scenarios.values()], default=len(self.steps))
         print(f'  {len(self.steps)} steps found. {timer.check()}')
+        if len(self.scenarios) > 0:
+            print(f'  {len(self.scenarios)} scenario(s) found, only run by the scenarios command.')
 
     def read_next_command(self) -> List[str]:
-        if self.cursor >= len(self.steps):
+        if self.cursor >= self.end:
             return None
         args = self.steps[self.cursor]
 
@@ -344,12 +701,17 @@ class StepsTab:
         return args
 from pprint import pprint
 class SummaryTab:
-    def __init__(self, tab: Tab):
+    def __init__(self, tab: Tab, restore: bool = False):
         self.tab = tab
         self.ref = tab.ref
         self.sheet = tab.sheet
 
         self.tab.type = 'summary'
+        ensure(self.tab.orientation == 'columns', 'The summary tab needs its periods as columns.')
+
+        if restore:
+            # summary vars and the tab name column were already set up by the interrupted run
+            return
 
         new_tab_vars = {}
         # capture summary_vars based on summary tab
@@ -370,6 +732,10 @@ class SummaryTab:
         self.tab.nudge_pcol(1)
 
     def summarize(self):
+        if self.sheet.settings['summary-mode'] == 'long':
+            self.summarize_long()
+            return
+
         timer = Timer()
         print(f'\n→ Performing summary...',end='')
 
@@ -419,7 +785,7 @@ class SummaryTab:
 
                         # this is expensive. made it not need it
                         # cellValues = t.get_period_cells_for_row(t.get_var_row(sv[0]))
-                        cellRefs.append(f'=\'{t.ref.title}\'!{row_col_to_cell_ref(t.get_var_row(sv[0]), t.get_pcol())}')
+                        cellRefs.append(self.period_ref(t, t.get_var_row(sv[0])))
                         # indented if part of group
                         tabNames.append((consts.GROUP_INDENT if t.group is not None else "") + t.friendly_name)
 
@@ -495,6 +861,52 @@ class SummaryTab:
 
         print(f'done. {timer.check()}\n')
 
+    def summarize_long(self):
+        """
+        Replaces the summary layout with one row per tab, summarized variable and period, referencing
+        the tab's cell, for pivots and other tools. Written as a single block.
+        """
+        timer = Timer()
+        print(f'\n→ Performing long-format summary...',end='')
+
+        block: List[List[any]] = [['Tab', 'Group', 'Variable', 'Period', 'Value']]
+        for t in self.sheet.summary_tab_order:
+            if t.type != 'dynamic' or t.get_pcol() is None:
+                continue
+            for sv in self.sheet.summary_vars:
+                if sv[0] not in t.vars:
+                    continue
+                row = t.get_var_row(sv[0])
+                for p in range(0, self.sheet.settings['periods']):
+                    block.append([
+                        t.friendly_name,
+                        t.group if t.group is not None else '',
+                        sv[0],
+                        p + 1,
+                        f'=\'{t.ref.title}\'!{t.cell_ref(row, t.get_pcol() + p)}'
+                    ])
+
+        gapi.clear_tab(self.ref, len(block), len(block[0]))
+        gapi.update_cells(self.ref, 1, 1, block)
+        # the template's layout is gone, so there are no variables or periods left to read back
+        self.tab.vars = {}
+        self.tab.cols = {}
+        self.tab.pcol = None
+        self.tab.gcol = None
+
+        print(f'done, {len(block) - 1} row(s). {timer.check()}\n')
+
+    def period_ref(self, t: Tab, row: int) -> str:
+        """
+        Formula for the first period of a tab's variable, to be copied across the summary's periods.
+        A tab with periods as rows is indexed by the summary's column instead, since a copied
+        reference would move along the wrong way.
+        """
+        if t.orientation == 'rows':
+            first = col_num_to_letter(self.tab.get_pcol())
+            return f'=INDEX({t.period_range_ref(row)},COLUMN()-COLUMN(${first}$1)+1)'
+        return f'=\'{t.ref.title}\'!{t.cell_ref(row, t.get_pcol())}'
+
     def period_group_count(self) -> int:
         return int((self.sheet.settings['periods'] - self.sheet.settings['summary-start'] + 1) / self.sheet.settings['summary-periods'])
     
@@ -0,0 +1,51 @@
+import pytest
+from types import SimpleNamespace
+
+from commands import contiguous_runs, parse_change, format_change, value_blocks, load_item, period_label, match_targets
+
+def test_contiguous_runs():
+    assert contiguous_runs([2, 3, 4, 7, 9, 10]) == [[2, 3, 4], [7], [9, 10]]
+
+def test_contiguous_runs_single_and_empty():
+    assert contiguous_runs([5]) == [[5]]
+    assert contiguous_runs([]) == []
+
+@pytest.mark.parametrize('arg, change', [('10%', 0.1), ('-5%', -0.05), ('+20%', 0.2), ('0.1', 0.1), ('-0.25', -0.25)])
+def test_parse_change(arg, change):
+    assert parse_change(arg) == pytest.approx(change)
+
+def test_format_change():
+    assert [format_change(c) for c in [-0.1, 0.1, 0.025]] == ['-10%', '+10%', '+2.5%']
+
+def test_value_blocks_stacks_rows_with_the_same_columns():
+    cells = {(2, 4): 1, (2, 5): 2, (3, 4): 3, (3, 5): 4}
+    assert value_blocks(cells) == [(2, 4, [[1, 2], [3, 4]])]
+
+def test_value_blocks_splits_gaps_and_different_runs():
+    cells = {
+        (2, 4): 'a', (2, 5): 'b', (2, 7): 'c',
+        (3, 4): 'd', (3, 5): 'e', (3, 6): 'f',
+        (5, 4): 'g', (5, 5): 'h'
+    }
+    assert value_blocks(cells) == [
+        (2, 4, [['a', 'b']]),
+        (2, 7, [['c']]),
+        (3, 4, [['d', 'e', 'f']]),
+        (5, 4, [['g', 'h']])
+    ]
+
+def test_value_blocks_empty():
+    assert value_blocks({}) == []
+
+@pytest.mark.parametrize('item, row', [(None, 1), ('', 1), ('2', 2), (3.0, 3), ('total', None), ('mem-a', None), (1.5, None)])
+def test_load_item(item, row):
+    assert load_item(item) == row
+
+@pytest.mark.parametrize('period, label', [('p3', 'p3'), ('3', 'p3'), (3, 'p3'), (3.0, 'p3'), ('3.0', 'p3'), ('p0', 'p0'), ('start', 'start')])
+def test_period_label(period, label):
+    assert period_label(period) == label
+
+def test_match_targets_keeps_the_first_of_overlapping_patterns():
+    t = SimpleNamespace(vars={'revenue': [3], 'fees': [4], 'fee_refunds': [5]}, get_var_rows=lambda var: [1])
+    assert match_targets(t, 'fees, fee*, revenue') == ['fees', 'fee_refunds', 'revenue']
+    assert match_targets(t, 'fee*:B, fees:B, fees:C') == ['fees:B', 'fee_refunds:B', 'fees:C']
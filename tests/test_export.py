@@ -0,0 +1,38 @@
+from export import summary_rows
+
+LAYOUT = {
+    'name': 'summary',
+    'vars': {'members': [2, 1], 'fees': [6, 1]},
+    'pcol': 4,
+    'periods': 2
+}
+
+def test_summary_rows():
+    rows = [
+        ['', '', '', 'P1', 'P2'],
+        ['members', '', '', 10, 20],
+        ['', 'grp', '', 10, 20],
+        ['', '    mem-a', '', 4, 8],
+        ['', '    Members B', '', 6, 12],
+        ['fees:last', '', '', 1, 2],
+        ['', 'mem-a', '', 1, 2]
+    ]
+    assert list(summary_rows(LAYOUT, rows)) == [
+        ['summary', 'members', 'total', 1, 10], ['summary', 'members', 'total', 2, 20],
+        ['summary', 'members', 'grp', 1, 10], ['summary', 'members', 'grp', 2, 20],
+        ['summary', 'members', 'mem-a', 1, 4], ['summary', 'members', 'mem-a', 2, 8],
+        ['summary', 'members', 'Members B', 1, 6], ['summary', 'members', 'Members B', 2, 12],
+        ['summary', 'fees', 'total', 1, 1], ['summary', 'fees', 'total', 2, 2],
+        ['summary', 'fees', 'mem-a', 1, 1], ['summary', 'fees', 'mem-a', 2, 2]
+    ]
+
+def test_summary_rows_skips_other_labels_and_pads_short_rows():
+    rows = [
+        ['', '', '', 'P1', 'P2'],
+        ['notes', 'not summarized', '', 1, 1],
+        ['members', '', '', 10],
+        ['', '']
+    ]
+    assert list(summary_rows(LAYOUT, rows)) == [
+        ['summary', 'members', 'total', 1, 10], ['summary', 'members', 'total', 2, '']
+    ]
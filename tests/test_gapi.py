@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import gapi
+
+TITLES = {1: 'inputs', 2: 'mem-a', 3: "it's"}
+
+@pytest.fixture(autouse=True)
+def titles(monkeypatch):
+    for sheet_id, title in TITLES.items():
+        monkeypatch.setitem(gapi.sheet_titles, sheet_id, title)
+
+def write(sheet_id: int, row: int, col: int, rows: list) -> dict:
+    return {'updateCells': {
+        'rows': [{'values': [{'userEnteredValue': gapi.parse_cell_value(v)} for v in r]} for r in rows],
+        'fields': 'userEnteredValue',
+        'start': {'sheetId': sheet_id, 'rowIndex': row - 1, 'columnIndex': col - 1}
+    }}
+
+def structural(sheet_id: int) -> dict:
+    return {'insertDimension': {'range': {'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': 3, 'endIndex': 4}}}
+
+def pipeline(unsettled: dict = None) -> gapi.Pipeline:
+    # only what split needs, without starting the pipeline's threads
+    p = object.__new__(gapi.Pipeline)
+    p.values = object()
+    p.lock = threading.Lock()
+    p.unsettled = unsettled or {}
+    p.unsettled_titles = {}
+    return p
+
+def test_value_range_numbers_and_formulas():
+    assert gapi.value_range(write(2, 3, 2, [[1, '=B3*2'], [3.5, 4]])) == {
+        'range': "'mem-a'!B3:C4",
+        'values': [[1, '=B3*2'], [3.5, 4]]
+    }
+
+def test_value_range_escapes_quotes_in_titles():
+    assert gapi.value_range(write(3, 1, 1, [[1]]))['range'] == "'it''s'!A1:A1"
+
+def test_value_range_leaves_text_and_unknown_tabs_alone():
+    assert gapi.value_range(write(2, 1, 1, [[1, 'text']])) is None
+    assert gapi.value_range(write(9, 1, 1, [[1]])) is None
+
+def test_split_moves_writes_to_settled_tabs_in_order():
+    requests = [write(2, 2, 4, [[1]]), write(1, 2, 2, [[2]]), structural(2), write(1, 3, 2, [[3]]), write(2, 3, 4, [[4]])]
+    kept, callbacks, data, sheets = pipeline().split(requests, [None] * len(requests))
+    # writes to the tab reshaped in the same batch stay, even the one before the reshaping
+    assert kept == [requests[0], requests[2], requests[4]]
+    assert callbacks == [None, None, None]
+    assert data == [{'range': "'inputs'!B2:B2", 'values': [[2]]}, {'range': "'inputs'!B3:B3", 'values': [[3]]}]
+    assert sheets == {1}
+
+def test_split_keeps_writes_to_tabs_with_batches_in_flight():
+    requests = [write(1, 2, 2, [[1]]), write(2, 2, 2, [[2]])]
+    kept, _, data, _ = pipeline({1: 1, 2: 0}).split(requests, [None, None])
+    assert kept == [requests[0]]
+    assert data == [{'range': "'mem-a'!B2:B2", 'values': [[2]]}]
+
+def test_split_keeps_writes_with_callbacks():
+    requests = [write(2, 2, 2, [[1]])]
+    callbacks = [lambda reply: None]
+    kept, kept_callbacks, data, _ = pipeline().split(requests, callbacks)
+    assert kept == requests and kept_callbacks == callbacks and data == []
+
+def test_split_keeps_formulas_referring_to_unsettled_tabs():
+    requests = [structural(1), write(2, 2, 2, [["='inputs'!B2"]]), write(2, 3, 2, [["='mem-a'!B2"]])]
+    kept, _, data, _ = pipeline().split(requests, [None] * len(requests))
+    assert kept == requests[:2]
+    assert data == [{'range': "'mem-a'!B3:B3", 'values': [["='mem-a'!B2"]]}]
@@ -0,0 +1,51 @@
+import pytest
+
+import consts
+from journal import Journal
+
+@pytest.fixture
+def journal(monkeypatch, tmp_path) -> Journal:
+    monkeypatch.setattr(consts, 'JOURNAL_DIR', str(tmp_path))
+    journal = Journal('book')
+    journal.start('hash')
+    return journal
+
+def flush(journal: Journal, new_tab: str = None):
+    replies = [{}] if new_tab is None else [{'duplicateSheet': {'properties': {'sheetId': 7, 'title': new_tab}}}]
+    journal.record_batch({'replies': replies}, journal.cut())
+
+def test_resume_point_after_the_last_committed_batch(journal):
+    journal.checkpoint(2, {'cursor': 2})
+    flush(journal, '-mem-a')
+    journal.checkpoint(3, {'cursor': 3})
+    flush(journal)
+    # step 5 was under way, but none of its batches landed before the run died
+    journal.checkpoint(5, {'cursor': 5})
+    assert journal.resume_point() == {'steps_hash': 'hash', 'cursor': 3, 'state': {'cursor': 3}}
+
+def test_resume_point_skips_batches_without_a_checkpoint(journal):
+    journal.checkpoint(2, {'cursor': 2})
+    flush(journal)
+    journal.pending = None
+    flush(journal)
+    assert journal.resume_point()['cursor'] == 2
+
+def test_resume_point_ignores_a_torn_last_line(journal):
+    journal.checkpoint(2, {'cursor': 2})
+    flush(journal)
+    journal.checkpoint(4, {'cursor': 4})
+    flush(journal)
+    with open(journal.path, 'r+') as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content[:-20])
+        f.truncate()
+    assert journal.resume_point()['cursor'] == 2
+
+def test_nothing_to_resume(journal):
+    assert journal.resume_point() is None # started, but no batch landed
+    journal.checkpoint(2, {'cursor': 2})
+    flush(journal)
+    journal.complete()
+    assert journal.resume_point() is None
+    assert Journal('other').resume_point() is None
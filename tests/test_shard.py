@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+import shard
+
+# assump is built, and only read from; a2 is mapped from a1, and everything but c1 from assump
+CELLS = {'assump': 100, 'a1': 400, 'a2': 400, 'b1': 500, 'c1': 300}
+DEPS = {'a1': {'assump'}, 'a2': {'a1', 'assump'}, 'b1': {'assump'}}
+TAB_VARS = {'assump': {'rate'}, 'a1': {'members'}, 'a2': {'members'}, 'b1': {'fees'}, 'c1': {'fees'}}
+
+def plan(monkeypatch, max_cells: int):
+    monkeypatch.setattr(shard, 'estimate_cells', lambda sheet: (100, dict(CELLS)))
+    monkeypatch.setattr(shard, 'walk_steps', lambda sheet: ([], DEPS, TAB_VARS))
+    sheet = SimpleNamespace(summary_vars=[('members', 'sum'), ('fees', 'sum')])
+    return shard.plan_shards(sheet, max_cells)
+
+def test_plan_shards_fits_in_one(monkeypatch):
+    assert plan(monkeypatch, 2000) == [['assump', 'a1', 'a2', 'b1', 'c1']]
+
+def test_plan_shards_keeps_linked_tabs_together_and_repeats_shared_ones(monkeypatch):
+    assert plan(monkeypatch, 1000) == [['assump', 'a1', 'a2'], ['assump', 'b1', 'c1']]
+
+def test_plan_shards_gives_oversized_groups_their_own_shard(monkeypatch):
+    shards = plan(monkeypatch, 700)
+    assert ['assump', 'a1', 'a2'] in shards
+    assert sorted(name for s in shards for name in s if name != 'assump') == ['a1', 'a2', 'b1', 'c1']
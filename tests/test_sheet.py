@@ -0,0 +1,29 @@
+import pytest
+
+from sheet import scenario_sections
+
+def test_scenario_sections():
+    steps = [
+        ['set', 'periods', '12'],
+        ['spawn', 'members', 'mem-a'],
+        ['scenario', 'low'],
+        ['bump', 'mem-a', 'fee', 'p2', '-5'],
+        ['Scenario', 'high'],
+        ['bump', 'mem-a', 'fee', 'p2', '5'],
+        ['map', 'assumptions', 'rate', 'mem-a', 'rate']
+    ]
+    assert scenario_sections(steps) == {'low': (3, 4), 'high': (5, 7)}
+
+def test_scenario_sections_none():
+    assert scenario_sections([['set', 'periods', '12']]) == {}
+
+def test_scenario_sections_empty_scenario():
+    assert scenario_sections([['scenario', 'base'], ['scenario', 'low']]) == {'base': (1, 1), 'low': (2, 2)}
+
+@pytest.mark.parametrize('steps', [
+    [['scenario']],
+    [['scenario', 'low'], ['scenario', 'low']]
+])
+def test_scenario_sections_rejects_unnamed_and_repeated(steps):
+    with pytest.raises(SystemExit):
+        scenario_sections(steps)
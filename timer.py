@@ -5,6 +5,8 @@ class Timer:
         self.start()
     def start(self):
         self.start = time.perf_counter()
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
     def check(self):
-        t = time.perf_counter() - self.start
+        t = self.elapsed()
         return "(🕑 {:.2f}ms)".format(t * 1000) if t < 1 else "(🕑 {:.2f}s)".format(t)
\ No newline at end of file